@@ -1,9 +1,25 @@
 import numpy as np
-import copy
+import colorsys
+
+from agents.conflict import stack_paths, conflict_times
+from agents.path import ticks_per_cell, straight, default_segment
+from agents.fleet import Fleet, FleetHistory
+from agents.planner import BFSPlanner
+from agents.message import Message
 
 class Aircraft:
     speed = 0.2
-    def __init__(self, id, src, dest, num_acs, zone_w, zone_h):
+    # Aircraft within this Chebyshev distance can communicate
+    comm_range = 2
+    # How many past positions are kept, -1 means all of them
+    history_length = -1
+    # Planner searching new paths, see agents/planner.py
+    planner = BFSPlanner()
+    def __init__(self, id, src, dest, num_acs, zone_w, zone_h, fleet=None):
+        '''
+            fleet: Fleet holding the state of all aircraft of the air zone, see agents/fleet.py.
+                   An aircraft without a fleet gets one of its own.
+        '''
         # ID of aircraft
         self.id = id
 
@@ -11,36 +27,41 @@ class Aircraft:
         self.source = src
         self.destination = dest
 
-        # Current position
-        self.x = src[0]
-        self.y = src[1]
-
-        # Current orientation
-        self.orientation = self.getOrientation()
-
-        # Whether has arrived
-        self.arrived = False
+        # Position, orientation, arrival and path cursor live in a row of the fleet
+        if fleet is None:
+            fleet = Fleet(Aircraft.speed, Aircraft.history_length)
+        self.fleet = fleet
+        self.index = fleet.add(self, src, dest)
 
         # Size of air zone
         self.zone_h = zone_h
         self.zone_w = zone_w
 
-        # Number of aircraft in the air zone
-        self.num_acs = len(self.recv_msg)
-
-        # Estimated time of arrival
-        self.eta = 0
-
-        # History and future paths
-        self.path_history = []
+        # History positions and future path, see agents/path.py. The planned path is
+        # never modified, a cursor points at the next position to move to.
+        self.path_history = FleetHistory(fleet, self.index)
         self.path = self.autoGenPath(src, dest)
 
+        # Current orientation
+        fleet.orientation[self.index] = self.getOrientation()
+
         # Priority list
         self.recognized_priority = None
 
-        # Message to be broadcast and received
+        # Message to be broadcast, and messages received from aircraft in range by id.
+        # {bc_status} is the status {bc_msg} was made from, see broadcast().
         self.bc_msg = None
-        self.recv_msg = [None for _ in range(num_acs)]
+        self.bc_status = None
+        self.version = 0
+        self.recv_msg = {}
+
+        # Last conflict check against every aircraft by id: (own version, other version,
+        # own plan, other plan, own cursor, other cursor, number of steps compared,
+        # last conflict step)
+        self.checked = {}
+
+        # Number of aircraft in the air zone
+        self.num_acs = num_acs
 
         # Colors for plotting
         self.danger_zone_color, self.history_color, self.path_color, \
@@ -48,23 +69,63 @@ class Aircraft:
 
         # How many steps ahead should be broadcast, -1 means full-length
         self.forecast_length = -1
-        
+
+    @property
+    def x(self):
+        return self.fleet.position.item(self.index, 0)
+
+    @property
+    def y(self):
+        return self.fleet.position.item(self.index, 1)
+
+    @property
+    def arrived(self):
+        return self.fleet.arrived.item(self.index)
+
+    @property
+    def cursor(self):
+        return self.fleet.cursor.item(self.index)
+
+    @property
+    def orientation(self):
+        return tuple(self.fleet.orientation[self.index].tolist())
+
+    @property
+    def path(self):
+        '''
+            The rest of the planned path, as a view.
+        '''
+        return self.plan[self.cursor:]
+
+    @path.setter
+    def path(self, path):
+        self.plan = path
+        self.plan.setflags(write=False)
+        self.fleet.set_plan(self.index, path)
+
+    @property
+    def eta(self):
+        '''
+            Estimated time of arrival.
+        '''
+        return len(self.plan) - self.cursor
+
     def broadcast(self):
         '''
-            Broadcast self status to others.
+            Broadcast self status to others. If nothing changed since the last
+            broadcast, the last message is broadcast again.
         '''
-        self.bc_msg = {
-            'id': self.id,
-            'x': self.x,
-            'y': self.y,
-            'orientation': self.orientation,
-            'eta': self.eta,
-            'path': self.path if self.forecast_length == -1 else \
-                    self.path[:int(round(self.forecast_length / self.speed))],
-            'arrived': self.arrived,
-            'dest': self.destination,
-            'recognized_priority': self.recognized_priority
-        }
+        status = (self.x, self.y, self.orientation, self.cursor, self.arrived,
+                  self.recognized_priority, self.forecast_length)
+        if self.bc_msg is not None and self.bc_status[0] is self.plan and self.bc_status[1] == status:
+            return
+        self.version += 1
+        self.bc_status = (self.plan, status)
+        self.bc_msg = Message(self.id, self.version, self.x, self.y, self.orientation, self.eta,
+                              self.path if self.forecast_length == -1 else \
+                              self.path[:int(round(self.forecast_length / self.speed))],
+                              self.arrived, self.destination, self.recognized_priority,
+                              self.plan, self.cursor)
     
     def checkMaxEta(self):
         '''
@@ -72,16 +133,16 @@ class Aircraft:
         '''
         eta_list = []
         id_list = []
-        for i in range(len(self.recv_msg)):
+        for i in sorted(list(self.recv_msg) + [self.id]):
             if i == self.id:
                 eta_list.append(self.eta)
                 id_list.append(self.id)
                 continue
-            if self.recv_msg[i] is not None:
-                eta_list.append(self.recv_msg[i]['eta'])
-                id_list.append(i)
+            eta_list.append(self.recv_msg[i].eta)
+            id_list.append(i)
 
-        self.recognized_priority = np.array(id_list)[np.argsort(-np.array(eta_list))].tolist()
+        # Ties are broken by id, so that all aircraft rank them alike
+        self.recognized_priority = np.array(id_list)[np.argsort(-np.array(eta_list), kind='stable')].tolist()
         self.broadcast()
 
     def getOrientation(self):
@@ -90,44 +151,74 @@ class Aircraft:
         '''
         if len(self.path) < 2:
             return self.orientation
-        dx = int(round((self.path[0][0] - self.x) / Aircraft.speed))
-        dy = int(round((self.path[0][1] - self.y) / Aircraft.speed))
+        dx = int(self.path[0][0]) - int(round(self.x / Aircraft.speed))
+        dy = int(self.path[0][1]) - int(round(self.y / Aircraft.speed))
         return (dx, dy)
 
+    def inRange(self, aircraft):
+        '''
+            Whether {aircraft} is close enough to communicate with.
+        '''
+        return int(max(abs(self.x - aircraft.x), abs(self.y - aircraft.y))) <= Aircraft.comm_range
+
     def fetch(self, aircraft, force_priority=False):
         '''
             Fetch message broadcast by other planes.
             If force_priority is True, hard copy the priority.
         '''
-        if int(max(abs(self.x - aircraft.x), abs(self.y - aircraft.y))) <= 2:
+        if self.inRange(aircraft):
             self.recv_msg[aircraft.id] = aircraft.bc_msg
             if force_priority:
-                self.recognized_priority = copy.deepcopy(aircraft.recognized_priority)
-                for i in range(len(self.recv_msg)):
-                    if self.recv_msg[i] is None and i != self.id and i in self.recognized_priority:
-                        self.recognized_priority.remove(i)
+                priority = [i for i in aircraft.recognized_priority
+                            if i == self.id or i in self.recv_msg]
+                # A list copied from an aircraft that did not hear of this one or of
+                # some aircraft it hears of keeps those at their former rank
+                former = self.recognized_priority or [self.id]
+                for rank, i in enumerate(former):
+                    if i not in priority and (i == self.id or i in self.recv_msg):
+                        priority.insert(min(rank, len(priority)), i)
+                self.recognized_priority = priority
         else:
-            self.recv_msg[aircraft.id] = None
+            self.recv_msg.pop(aircraft.id, None)
 
     def willCollide(self):
         '''
             Detect whether collision(s) will happen in the future.
         '''
-        collide_id = []
-        for msg in self.recv_msg:
-            if msg is not None:
-                for i in range(min(len(self.path), len(msg['path']))):
-                    if self.path[i][0] == msg['path'][i][0] and \
-                       self.path[i][1] == msg['path'][i][1]:
-                        collide_id.append(msg['id'])
-                        break
-                    if i < min(len(self.path), len(msg['path'])) - 1:
-                        if self.path[i+1][0] == msg['path'][i][0] and \
-                           self.path[i+1][1] == msg['path'][i][1] and \
-                           self.path[i][0] == msg['path'][i+1][0] and \
-                           self.path[i][1] == msg['path'][i+1][1]:  
-                            collide_id.append(msg['id'])
-                            break
+        msgs = list(self.recv_msg.values())
+
+        # A pair is not checked again if neither message changed since the last
+        # check. Plans never change and both cursors advance one step per tick, so a
+        # pair checked {shift} ticks ago still conflicts if its last conflict is at
+        # least {shift} steps ahead, as long as neither aircraft replanned or stopped
+        # and the compared steps end at the same time
+        stale = []
+        collide = {}
+        for msg in msgs:
+            checked = self.checked.get(msg.id)
+            if checked is not None and checked[0] == self.version and checked[1] == msg.version:
+                collide[msg.id] = checked[7] >= 0
+                continue
+            if checked is not None and checked[2] is self.plan and checked[3] is msg.plan:
+                shift = self.cursor - checked[4]
+                if shift >= 0 and msg.cursor - checked[5] == shift and \
+                   shift + min(len(self.path), len(msg.path)) == checked[6]:
+                    collide[msg.id] = checked[7] >= shift
+                    continue
+            stale.append(msg)
+
+        if len(stale) > 0:
+            # Compare against all changed paths at once
+            length = max([len(self.path)] + [len(msg.path) for msg in stale])
+            own, own_len = stack_paths([self.path], length)
+            others, others_len = stack_paths([msg.path for msg in stale], length)
+            last = conflict_times(own, own_len, others, others_len, last=True)[0]
+            for msg, t in zip(stale, last):
+                self.checked[msg.id] = (self.version, msg.version, self.plan, msg.plan, self.cursor, msg.cursor,
+                                        min(len(self.path), len(msg.path)), int(t))
+                collide[msg.id] = t >= 0
+
+        collide_id = [msg.id for msg in msgs if collide[msg.id]]
 
         return (False, collide_id) if len(collide_id) == 0 else (True, collide_id)
 
@@ -137,287 +228,79 @@ class Aircraft:
             Suggest a new path to avoid collision!
         '''
 
-        def getorienid(orien):
-            if orien[0] == 0 and orien[1] == 1:
-                return 0
-            if orien[0] == 0 and orien[1] == -1:
-                return 1
-            if orien[0] == 1 and orien[1] == 0:
-                return 2
-            if orien[0] == -1 and orien[1] == 0:
-                return 3
-
-        def getPreferenceList(cur_x, cur_y, dest_x, dest_y):
-            dx = abs(cur_x - dest_x)
-            dy = abs(cur_y - dest_y)
-
-            if cur_x < dest_x and cur_y < dest_y:
-                if dx > dy:
-                    outp = [(1, 0), (0, 1), (-1, 0), (0, -1)]
-                else:
-                    outp = [(0, 1), (1, 0), (0, -1), (-1, 0)]
-
-            if cur_x > dest_x and cur_y < dest_y:
-                if dx > dy:
-                    outp = [(-1, 0), (0, 1), (1, 0), (0, -1)]
-                else:
-                    outp = [(0, 1), (-1, 0), (0, -1), (1, 0)]
-
-            if cur_x < dest_x and cur_y > dest_y:
-                if dx > dy:
-                    outp = [(1, 0), (0, -1), (-1, 0), (0, 1)]
-                else:
-                    outp = [(0, -1), (1, 0), (0, -1), (1, 0)]
-            
-            if cur_x > dest_x and cur_y > dest_y:
-                if dx > dy:
-                    outp = [(-1, 0), (0, -1), (1, 0), (0, 1)]
-                else:
-                    outp = [(0, -1), (-1, 0), (0, 1), (1, 0)]
-
-            if cur_x == dest_x:
-                if cur_y > dest_y:
-                    outp = [(0, -1), (-1, 0), (1, 0), (0, 1)]
-                else:
-                    outp = [(0, 1), (-1, 0), (1, 0), (0, -1)]
-
-            if cur_y == dest_y:
-                if cur_x > dest_x:
-                    outp = [(-1, 0), (0, -1), (0, 1), (1, 0)]
-                else:
-                    outp = [(1, 0), (0, -1), (0, 1), (-1, 0)]
-
-            return outp
-
         if self.recognized_priority[0] == self.id:
             return True
 
-        # Self status
-        x_a = int(self.x)
-        y_a = int(self.y)
-        orientation_a = self.orientation
-        dest_ax, dest_ay = self.destination
-
-        eta = self.eta
-
-        # state: (x_a, y_a, o_a, time_used, state_id, last_state_id)
-        sid = 1
-        ptr = 0
-        BFS_queue = [(x_a, y_a, orientation_a, 0, 0, -1)]
-        used_state = np.zeros((self.zone_h + 1, self.zone_w + 1, 4))
-
-        dead_end = False
-
-        # BFS cycle
-        while True:
-            if ptr >= len(BFS_queue):
-                dead_end = True
-                break
-
-            # Fetch the first state to be searched
-            state = BFS_queue[ptr]
-
-            # Test if both aircrafts has reached their destination
-            if state[0] == dest_ax and state[1] == dest_ay:
-                break
-            
-            # Refresh pointer
-            ptr += 1
-
-            # Neither aircraft has arrived:
-            # Try different move combinations
-            ma_iter = getPreferenceList(state[0], state[1], dest_ax, dest_ay)
-            for ma in ma_iter:
-                # Aircrafts are not allowed to make U-turns
-                if ma[0] + state[2][0] == 0 and ma[1] + state[2][1] == 0:
-                    continue
-                new_state = (state[0] + ma[0], 
-                             state[1] + ma[1],
-                             ma,
-                             state[3] + 1,
-                             sid,
-                             state[4])
-                
-                # Bound check: 
-                if new_state[0] < 0 or new_state[0] > self.zone_w or \
-                   new_state[1] < 0 or new_state[1] > self.zone_h: 
-                    continue
-                
-                # Used states are not considered
-                orien_id = getorienid(new_state[2])
-                if used_state[new_state[0], new_state[1], orien_id] == 1:
-                    continue
-
-                # Safety requirements: no collision allowed
-                safe = True
-                num_constraints = self.recognized_priority.index(self.id)
-                for c in range(num_constraints):
-                    cid = self.recognized_priority[c]
-                    x_b = int(self.recv_msg[cid]['x'])
-                    y_b = int(self.recv_msg[cid]['y'])
-                    constraint_path = self.recv_msg[cid]['path']
-                    if len(constraint_path) >= 5 * new_state[3]:
-                        if new_state[0] == constraint_path[5 * new_state[3] - 1][0] and \
-                           new_state[1] == constraint_path[5 * new_state[3] - 1][1]:
-                            safe = False
-                            break
-                    if new_state[0] == x_b and new_state[1] == y_b and \
-                       constraint_path[4][0] == state[0] and constraint_path[4][1] == state[1]:
-                        safe = False
-                        break
-                    if len(constraint_path) >= 5 * new_state[3] and len(constraint_path) >= 10:
-                        if new_state[0] == constraint_path[5 * new_state[3] - 6][0] and \
-                           new_state[1] == constraint_path[5 * new_state[3] - 6][1] and \
-                           state[0] == constraint_path[5 * new_state[3] - 1][0] and \
-                           state[1] == constraint_path[5 * new_state[3] - 1][1]:
-                            safe = False
-                            break
-                if not safe:
-                    continue
-
-                # Cost pruning: if time consumed is larger than current eta + 4, do not consider it as a good solution
-                fastest_eta = abs(new_state[0] - dest_ax) + abs(new_state[1] - dest_ay)
-                if new_state[3] + fastest_eta > eta + self.num_acs * 2 - 2:
-                    continue                   
-
-                # Considerable states are stored for further searching
-                BFS_queue.append(new_state)
-                sid += 1
-
-                # Searched state are recorded
-                used_state[new_state[0], new_state[1], orien_id] = 1
+        cells = Aircraft.planner.plan(self)
 
         # If dead_end occurs, do priority shuffle and return with failure
-        if dead_end:
+        if cells is None:
             sid = self.recognized_priority.index(self.id)
             self.recognized_priority = [self.id] + self.recognized_priority[:sid] + self.recognized_priority[sid + 1:]
             self.broadcast()
             return False
 
-        # Track back to restore the full path
-        suggested_path = []
-        while ptr != -1:
-            suggested_path = [BFS_queue[ptr]] + suggested_path
-            ptr = BFS_queue[ptr][-1]
-        
-        # Build the path information
-        suggested_a = []
-        for i in range(len(suggested_path)):
-            # First step: directly append the point 
-            if i == 0:
-                suggested_a.append((suggested_path[i][0], suggested_path[i][1]))
-            # Not the first step: append interpolated points
-            elif not (suggested_a[-1][0] == dest_ax and suggested_a[-1][1] == dest_ay):
-                # Moving horizontally
-                if suggested_a[-1][0] != suggested_path[i][0]:
-                    direction = -1 if suggested_a[-1][0] > suggested_path[i][0] else 1
-                    suggested_a = suggested_a + [(round(j * Aircraft.speed, 2), suggested_path[i][1]) \
-                        for j in range(int(round((suggested_a[-1][0] + direction * Aircraft.speed) / Aircraft.speed)), 
-                                       int(round((suggested_path[i][0] + direction * Aircraft.speed) / Aircraft.speed)),
-                                       direction)]
-                # Moving vertically
-                else:
-                    assert suggested_a[-1][1] != suggested_path[i][1]
-                    direction = -1 if suggested_a[-1][1] > suggested_path[i][1] else 1
-                    suggested_a = suggested_a + [(suggested_path[i][0], round(j * Aircraft.speed, 2)) \
-                        for j in range(int(round((suggested_a[-1][1] + direction * Aircraft.speed) / Aircraft.speed)), 
-                                       int(round((suggested_path[i][1] + direction * Aircraft.speed) / Aircraft.speed)),
-                                       direction)]
+        # Ticks needed to cross a cell, cells are positions while paths count ticks
+        S = ticks_per_cell(Aircraft.speed)
+
+        # Build the path information: interpolate between the cells, leaving out
+        # the current position
+        suggested_a = [np.zeros((0, 2), dtype=np.int32)]
+        for prev, cur in zip(cells[:-1], cells[1:]):
+            suggested_a.append(straight(np.array(prev) * S, np.array(cur) * S))
 
         self.path = self.autoGenPath(self.source,
                                      self.destination,
-                                     suggested_a[1:])
+                                     np.concatenate(suggested_a))
         self.broadcast()
 
         return True
 
-    def autoGenPath(self, begin, end, default_path=[]):
+    def autoGenPath(self, begin, end, default_path=None):
         '''
             begin, end: (x, y) tuple, default begin and end position for the aircraft
-            path: list of (x, y) tuple, a section of path the aircraft MUST take to avoid collision
+            default_path: a section of path the aircraft MUST take to avoid collision
             -----------------------------------------------
             Generate the shortest path from {begin} to {end}. The very beginning of this path must 
             be the beginning point of {default_path} if it is provided.
         '''
+        S = ticks_per_cell(Aircraft.speed)
 
         # Changes the beginning point to the last position in {default_path} if it is provided
-        if len(default_path) != 0:
-            begin = default_path[-1]
+        if default_path is not None and len(default_path) != 0:
+            begin = (int(default_path[-1][0]), int(default_path[-1][1]))
+        else:
+            begin = (int(begin[0]) * S, int(begin[1]) * S)
+            default_path = None
+        end = (int(end[0]) * S, int(end[1]) * S)
 
-        # Calculate the distance the aircraft has to travel in both x and y direction.
+        # The rest is a cached read-only segment, used as is when there is no prefix.
         # The aircraft by default first travels along the direction with the larger delta.
-        delta_x = abs(begin[0] - end[0])
-        delta_y = abs(begin[1] - end[1])
-
-        if delta_x == 0 and delta_y == 0:
-            self.eta = len(default_path)
-            return default_path
-
-        direction_x = -1 if begin[0] > end[0] else 1 if begin[0] < end[0] else 0
-        direction_y = -1 if begin[1] > end[1] else 1 if begin[1] < end[1] else 0
-        
-        if delta_x > delta_y:
-            path1 = [(round(i * Aircraft.speed, 2), begin[1]) \
-                      for i in range(int(round((begin[0] + direction_x * Aircraft.speed) / Aircraft.speed)), 
-                                     int(round((end[0] + direction_x * Aircraft.speed) / Aircraft.speed)), 
-                                     direction_x)]
-            path2 = []
-            if delta_y > 0:
-                path2 = [(end[0], round(i * Aircraft.speed, 2)) \
-                          for i in range(int(round((begin[1] + direction_y * Aircraft.speed) / Aircraft.speed)), 
-                                         int(round((end[1] + direction_y * Aircraft.speed) / Aircraft.speed)),
-                                         direction_y)]
-            path = default_path + path1 + path2
-
-        else:
-            path1 = [(begin[0], round(i * Aircraft.speed, 2)) \
-                      for i in range(int(round((begin[1] + direction_y * Aircraft.speed) / Aircraft.speed)),
-                                     int(round((end[1] + direction_y * Aircraft.speed) / Aircraft.speed)), 
-                                     direction_y)]
-            path2 = []
-            if delta_x > 0:
-                path2 = [(round(i * Aircraft.speed, 2), end[1]) \
-                        for i in range(int(round((begin[0] + direction_x * Aircraft.speed) / Aircraft.speed)), 
-                                       int(round((end[0] + direction_x * Aircraft.speed) / Aircraft.speed)), 
-                                       direction_x)]
-            path = default_path + path1 + path2
-        
-        self.eta = len(path)
-        return path
+        segment = default_segment(begin, end)
+        if default_path is None:
+            return segment
+        return np.concatenate([default_path, segment])
 
     def genColor(self, id):
-        # Generate display color for each aircraft
-        assert id in [0, 1, 2]
-        if id == 0:
-            dzone_color = [255, 150, 150]
-            hist_color = [255, 50, 50]
-            path_color = [255, 50, 50]
-            dest_color = [255, 100, 100]
-            disp_color = [255, 0, 0]
-        if id == 1:
-            dzone_color = [150, 150, 255]
-            hist_color = [50, 50, 255]
-            path_color = [50, 50, 255]
-            dest_color = [100, 100, 255]
-            disp_color = [0, 0, 255]
-        if id == 2:
-            dzone_color = [150, 255, 150]
-            hist_color = [50, 255, 50]
-            path_color = [50, 255, 50]
-            dest_color = [100, 255, 100]
-            disp_color = [0, 255, 0]
+        '''
+            Generate display color for each aircraft. The first three aircraft are
+            blue, red and green, the hues of the others are spread by the golden ratio
+            so that any number of aircraft get distinguishable colors.
+        '''
+        if id < 3:
+            disp_color = [[255, 0, 0], [0, 0, 255], [0, 255, 0]][id]
+        else:
+            r, g, b = colorsys.hsv_to_rgb((id * 0.618033988749895) % 1, 1, 1)
+            disp_color = [int(b * 255), int(g * 255), int(r * 255)]
+
+        # Lighter shades of the display color
+        dzone_color = [max(c, 150) for c in disp_color]
+        hist_color = [max(c, 50) for c in disp_color]
+        path_color = [max(c, 50) for c in disp_color]
+        dest_color = [max(c, 100) for c in disp_color]
         return dzone_color, hist_color, path_color, dest_color, disp_color
 
     def move(self):
         # Let the aircraft move for one timestep. If it reaches its destination, change its state {arrival}.
-        if self.arrived:
-            return
-        assert len(self.path) > 0
-        self.path_history.append((self.x, self.y))
-        self.orientation = self.getOrientation()
-        self.x, self.y = self.path[0]
-        self.path = self.path[1:]
-        self.eta = len(self.path)
-        if self.x == self.destination[0] and self.y == self.destination[1]:
-            assert self.eta == 0
-            self.arrived = True
+        # All aircraft of a fleet move at once with Fleet.move().
+        self.fleet.move([self.index])
@@ -0,0 +1,125 @@
+import numpy as np
+
+def stack_paths(paths, length=0):
+    '''
+        Stack paths (see agents/path.py) of different lengths into one padded
+        (N, T, 2) array, T being at least {length}. Returns the array and the
+        path lengths.
+    '''
+    lengths = np.array([len(path) for path in paths], dtype=np.int64)
+    T = max(int(lengths.max()) if len(paths) > 0 else 0, length)
+    stacked = np.full((len(paths), T, 2), -1, dtype=np.int32)
+    for n, path in enumerate(paths):
+        stacked[n, :len(path)] = path
+    return stacked, lengths
+
+def first_step(conflict):
+    # First step along the last axis at which {conflict} holds, -1 if it never does
+    return np.where(conflict.any(axis=-1), conflict.argmax(axis=-1), -1)
+
+def last_step(conflict):
+    # Last step along the last axis at which {conflict} holds, -1 if it never does
+    T = conflict.shape[-1]
+    return np.where(conflict.any(axis=-1), T - 1 - conflict[..., ::-1].argmax(axis=-1), -1)
+
+def earliest(first_a, first_b):
+    # Element-wise earliest of two arrays of first conflict steps
+    return np.where(first_a < 0, first_b, np.where(first_b < 0, first_a, np.minimum(first_a, first_b)))
+
+def conflict_steps(a, len_a, b, len_b, last=False):
+    '''
+        a: (Na, T, 2) stacked paths, len_a: their lengths
+        b: (Nb, T, 2) stacked paths, len_b: their lengths
+        -----------------------------------------------
+        Compare every path in {a} with every path in {b} in one pass. Two paths
+        conflict at step i if they occupy the same position at step i, or if
+        they swap positions between step i and i + 1. Steps beyond the end of
+        either path are not compared. Returns the (Na, Nb) first steps, or last
+        steps if {last}, at which two paths occupy the same position and at which
+        they swap positions, -1 where they never do.
+    '''
+    pick = last_step if last else first_step
+    T = a.shape[1]
+    none = np.full((a.shape[0], b.shape[0]), -1, dtype=np.int64)
+    if T == 0:
+        return none, none
+    horizon = np.minimum(len_a[:, None], len_b[None, :])
+    steps = np.arange(T)
+
+    # View every int32 (x, y) position as a single int64, so that positions
+    # are compared in one operation
+    a = np.ascontiguousarray(a, dtype=np.int32).view(np.int64)[..., 0]
+    b = np.ascontiguousarray(b, dtype=np.int32).view(np.int64)[..., 0]
+
+    # Same position at the same step
+    same = a[:, None] == b[None, :]
+    same &= steps[None, None, :] < horizon[:, :, None]
+
+    # Swapped positions between two consecutive steps
+    if T == 1:
+        return pick(same), none
+    swap = (a[:, None, 1:] == b[None, :, :-1]) & (a[:, None, :-1] == b[None, :, 1:])
+    swap &= steps[None, None, :-1] < horizon[:, :, None] - 1
+    return pick(same), pick(swap)
+
+def conflict_times(a, len_a, b, len_b, last=False):
+    '''
+        Like conflict_steps(), but returns the (Na, Nb) first steps, or last steps
+        if {last}, of any conflict, -1 where two paths never conflict.
+    '''
+    if last:
+        return np.maximum(*conflict_steps(a, len_a, b, len_b, last=True))
+    return earliest(*conflict_steps(a, len_a, b, len_b))
+
+def detect_conflict_steps(paths, chunk_size=64):
+    '''
+        Apply conflict_steps() to all pairs of {paths}, {chunk_size} paths at a time
+        against all others to bound memory use. The diagonal is -1.
+    '''
+    stacked, lengths = stack_paths(paths)
+    same = np.empty((len(paths), len(paths)), dtype=np.int64)
+    swap = np.empty((len(paths), len(paths)), dtype=np.int64)
+    for start in range(0, len(paths), chunk_size):
+        end = start + chunk_size
+        same[start:end], swap[start:end] = conflict_steps(stacked[start:end], lengths[start:end], stacked, lengths)
+    np.fill_diagonal(same, -1)
+    np.fill_diagonal(swap, -1)
+    return same, swap
+
+def detect_conflicts(paths, chunk_size=64):
+    '''
+        Find the conflicts between all pairs of {paths}.
+        Returns the (N, N) conflict matrix and the first conflict step of every
+        pair, -1 where the pair does not conflict.
+    '''
+    first = earliest(*detect_conflict_steps(paths, chunk_size))
+    return first >= 0, first
+
+def conflict_components(conflicts):
+    '''
+        conflicts: {aircraft id: ids of the aircraft it foresees a conflict with}
+        -----------------------------------------------
+        Connected components of the conflict graph, leaving out aircraft without
+        any conflict. Every component is a list of ids in increasing order, and
+        components are ordered by their smallest id.
+    '''
+    # Union-find over the ids taking part in a conflict
+    parent = {}
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, others in conflicts.items():
+        for j in others:
+            parent.setdefault(i, i)
+            parent.setdefault(j, j)
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    components = {}
+    for i in sorted(parent):
+        components.setdefault(find(i), []).append(i)
+    return [components[root] for root in sorted(components)]
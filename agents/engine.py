@@ -0,0 +1,311 @@
+import bisect
+import heapq
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from agents.aircraft import Aircraft
+from agents.conflict import conflict_components, conflict_times, stack_paths
+from agents.path import ticks_per_cell
+from agents.zone import Zone
+
+# Outcome of one simulation, see Simulation.run()
+SimulationResult = namedtuple('SimulationResult',
+                              ['success', 'ticks', 'flight_time', 'dead_ends', 'expansions', 'profile'],
+                              defaults=[None])
+
+class Simulation:
+    '''
+        Runs one scenario at one forecast length. Every {cycle} ticks the aircraft
+        go through SB -> IC -> PD -> IC -> CD and, if a collision is foreseen, RP.
+        Every tick ends with M.
+
+        Callbacks registered with on() are called at these events:
+            'tick'      (zone, tick) at the start of every tick and once more when all aircraft have arrived
+            'collision' (zone, tick) when CD foresees a collision
+            'dead_end'  (zone, tick, failed) when RP fails for the aircraft ids in {failed}
+            'finish'    (zone, result) when the simulation is over
+        Observers such as agents.render.VideoObserver are attached with add_observer().
+        With a PhaseProfile (see agents/profiling.py) the time of every phase is measured.
+
+        Ticks in which nothing can happen, up to the next round of communication in
+        which two flying aircraft may be within communication range or the arrival
+        of the last aircraft, are skipped at once. A round without any aircraft in
+        range foresees no collision and leaves nothing behind that later rounds
+        use, so results and tick counts are those of the tick by tick loop. Nothing
+        is skipped while 'tick' callbacks are registered or phases are measured,
+        as they expect every tick.
+    '''
+    # Flight time recorded for a case in which RP fails {max_redos} times in a row
+    failure_time = 50000000
+
+    def __init__(self, spec, forecast_length=-1, cycle=5, max_redos=3, profile=None, skip_quiet=True):
+        '''
+            spec: scenario made by Zone.snapshot()
+            forecast_length: how many steps ahead aircraft broadcast, -1 means full-length
+            cycle: number of ticks between two rounds of communication and collision avoidance
+            max_redos: number of RP rounds ending in a dead end before the case fails
+            profile: PhaseProfile the phases are measured with, None disables measuring
+            skip_quiet: skip the ticks in which nothing can happen, see above
+        '''
+        self.zone = Zone.from_spec(spec)
+        for ac in self.zone.aclist:
+            ac.forecast_length = forecast_length
+        self.cycle = cycle
+        self.max_redos = max_redos
+        self.hooks = {'tick': [], 'collision': [], 'dead_end': [], 'finish': []}
+        self.tick = 0
+        self.profile = profile
+        self.skip_quiet = skip_quiet
+
+        # Conflicts foreseen by the last CD phase: {aircraft id: ids it conflicts with}
+        self.conflicts = {}
+
+    def clock(self):
+        return time.perf_counter_ns() if self.profile is not None else 0
+
+    def lap(self, phase, start):
+        '''
+            Charge the time since {start} to {phase} if profiling, returns the current time.
+        '''
+        if self.profile is None:
+            return 0
+        return self.profile.add(phase, start)
+
+    def count(self, counter, n=1):
+        if self.profile is not None:
+            self.profile.count(counter, n)
+
+    def on(self, event, callback):
+        self.hooks[event].append(callback)
+
+    def emit(self, event, *args):
+        for callback in self.hooks[event]:
+            callback(self.zone, *args)
+
+    def add_observer(self, observer):
+        '''
+            Call {observer}.observe(zone, tick) every tick and {observer}.close() at the end.
+        '''
+        self.on('tick', observer.observe)
+        self.on('finish', lambda zone, result: observer.close())
+
+    def communicate(self):
+        '''
+            SB -> IC -> PD -> IC -> CD phases. Returns whether a collision is foreseen.
+        '''
+        zone = self.zone
+        start = self.clock()
+
+        # SB
+        for ac in zone.aclist:
+            ac.broadcast()
+        start = self.lap('SB', start)
+
+        # IC
+        zone.communicate()
+        self.count_messages()
+        start = self.lap('IC', start)
+
+        # PD
+        for ac in zone.aclist:
+            ac.checkMaxEta()
+        start = self.lap('PD', start)
+
+        # IC
+        zone.communicate()
+        self.count_messages()
+        start = self.lap('IC', start)
+
+        # CD
+        collision = False
+        self.conflicts = {}
+        for ac in zone.aclist:
+            coll, cid = ac.willCollide()
+            if coll:
+                self.conflicts[ac.id] = cid
+            collision = collision or coll
+        self.lap('CD', start)
+        return collision
+
+    def count_messages(self):
+        if self.profile is not None:
+            self.profile.count('messages', sum(len(ac.recv_msg) for ac in self.zone.aclist))
+
+    def replan(self):
+        '''
+            RP phase: the aircraft of every connected component of the conflict graph
+            modify their paths according to priority to avoid collision, aircraft
+            without conflicts keep theirs. An aircraft whose new path conflicts with
+            an aircraft of lower priority in range makes it join the component and
+            replan as well, until no new path conflicts with any. Components ending
+            in a dead end are replanned again. Returns the number of rounds ending
+            in a dead end and whether the last round succeeded.
+        '''
+        zone = self.zone
+        start = self.clock()
+        self.count('replans')
+
+        # Components do not depend on each other's result
+        components = conflict_components(self.conflicts)
+        count = 0
+        while count < self.max_redos:
+            failed = set()
+            for component in components:
+                # Aircraft still to replan, smallest id first, and how often each one replanned
+                pending = list(component)
+                replans = {}
+                while len(pending) > 0:
+                    id = heapq.heappop(pending)
+                    ac1 = zone.aclist[id]
+                    plan = ac1.plan
+                    # A dead end stands for the round even if the aircraft replans again
+                    if not ac1.modifyPath():
+                        failed.add(id)
+                    replans[id] = replans.get(id, 0) + 1
+                    neighbors = zone.neighbors(ac1)
+                    for ac2 in neighbors:
+                        ac2.fetch(ac1)
+                    self.count('messages', len(neighbors))
+                    if ac1.plan is plan:
+                        continue
+
+                    # An aircraft replanning more often than there are aircraft is
+                    # caught up in inconsistent priorities, leave it to the next CD
+                    for ac2 in self.yielding(ac1, neighbors):
+                        if ac2.id not in component:
+                            bisect.insort(component, ac2.id)
+                        if ac2.id not in pending and replans.get(ac2.id, 0) < len(zone.aclist):
+                            heapq.heappush(pending, ac2.id)
+            failed = sorted(failed)
+            if len(failed) == 0:
+                self.lap('RP', start)
+                return count, True
+
+            # Dead-end occurs, shuffle priority and redo the components it occurred in
+            print("\tDead end occurs.")
+            self.count('redos')
+            self.count('dead_end_aircraft', len(failed))
+            self.emit('dead_end', self.tick, failed)
+            # Every receiver copies the lists of the failed aircraft in range in id order,
+            # receivers in id order, so that no list is overwritten before it is copied
+            receivers = {}
+            for id in failed:
+                for ac1 in zone.neighbors(zone.aclist[id]):
+                    receivers.setdefault(ac1.id, []).append(zone.aclist[id])
+            for receiver in sorted(receivers):
+                for ac2 in receivers[receiver]:
+                    zone.aclist[receiver].fetch(ac2, force_priority=True)
+                self.count('messages', len(receivers[receiver]))
+            components = [component for component in components
+                          if any(id in failed for id in component)]
+            # Aircraft now ranking a failed aircraft above themselves replan around it
+            for component in components:
+                for id in [id for id in component if id in failed]:
+                    ac1 = zone.aclist[id]
+                    for ac2 in self.yielding(ac1, zone.neighbors(ac1)):
+                        if ac2.id not in component:
+                            bisect.insort(component, ac2.id)
+            count += 1
+        self.lap('RP', start)
+        return count, False
+
+    def yielding(self, ac, neighbors):
+        '''
+            The flying aircraft of {neighbors} ranking {ac} above themselves whose
+            paths conflict with the path {ac} broadcast, as CD would find.
+        '''
+        others = [other for other in neighbors if not other.arrived and other.recognized_priority is not None
+                  and ac.id in other.recv_msg and ac.id in other.recognized_priority
+                  and other.recognized_priority.index(ac.id) < other.recognized_priority.index(other.id)]
+        if len(others) == 0:
+            return []
+        path = ac.bc_msg.path
+        length = max([len(path)] + [len(other.path) for other in others])
+        own, own_len = stack_paths([path], length)
+        paths, lengths = stack_paths([other.path for other in others], length)
+        first = conflict_times(own, own_len, paths, lengths)[0]
+        return [other for other, t in zip(others, first) if t >= 0]
+
+    def move(self, ticks=1):
+        # M, for {ticks} ticks at once
+        start = self.clock()
+        if ticks == 1:
+            self.zone.fleet.move()
+        else:
+            self.zone.fleet.advance(ticks)
+        self.lap('M', start)
+        self.tick += ticks
+
+    def quiet_ticks(self):
+        '''
+            Number of ticks from the current one, which has been dealt with, to the
+            next one in which something can happen: a round of communication with two
+            flying aircraft possibly within communication range, or the arrival of the
+            last aircraft.
+        '''
+        fleet = self.zone.fleet
+        last = int((fleet.lengths - fleet.cursor)[fleet.active].max())
+        if len(fleet.active) < 2:
+            return last
+
+        # Truncated distances below comm_range + 1 cells are in range, points count ticks.
+        # A distance of exactly comm_range + 1 cells may be truncated below by rounding.
+        reach = (Aircraft.comm_range + 1) * ticks_per_cell(Aircraft.speed)
+
+        # Check the next rounds, twice as many at a time as long as none has aircraft in range
+        first = self.cycle - self.tick % self.cycle
+        rounds = 1
+        while first < last:
+            ticks = np.arange(first, min(first + rounds * self.cycle, last), self.cycle)
+            points, flying = fleet.points_after(ticks)
+            distance = np.abs(points[:, :, None] - points[:, None, :]).max(axis=-1)
+            close = (distance <= reach) & flying[:, :, None] & flying[:, None, :]
+            close[:, np.arange(len(fleet.active)), np.arange(len(fleet.active))] = False
+            found = close.any(axis=(1, 2))
+            if found.any():
+                return int(ticks[found.argmax()])
+            first = int(ticks[-1]) + self.cycle
+            rounds = min(2 * rounds, max(1, 2 ** 22 // len(fleet.active) ** 2))
+        return last
+
+    def run(self):
+        '''
+            Run the simulation until all aircraft have arrived or RP fails.
+            Returns a SimulationResult.
+        '''
+        expansions = Aircraft.planner.expansions
+        dead_ends = 0
+        success = True
+        while True:
+            if self.profile is not None:
+                self.profile.begin_tick()
+            start = self.clock()
+            self.emit('tick', self.tick)
+            self.lap('render', start)
+
+            # If all planes have arrived, exit
+            if self.zone.fleet.all_arrived():
+                break
+
+            # Correspondence and collision avoidance occurs every {cycle} time steps
+            if self.tick % self.cycle == 0 and self.communicate():
+                self.emit('collision', self.tick)
+                redos, success = self.replan()
+                dead_ends += redos
+                if not success:
+                    break
+
+            if self.skip_quiet and len(self.hooks['tick']) == 0 and self.profile is None:
+                self.move(self.quiet_ticks())
+            else:
+                self.move()
+
+        flight_time = self.tick * Aircraft.speed if success else Simulation.failure_time
+        expansions = Aircraft.planner.expansions - expansions
+        self.count('expansions', expansions)
+        result = SimulationResult(success, self.tick, flight_time, dead_ends, expansions,
+                                  self.profile.summary() if self.profile is not None else None)
+        self.emit('finish', result)
+        return result
@@ -0,0 +1,258 @@
+'''
+    Struct-of-arrays store of the state of all aircraft in an air zone. The
+    position, orientation, plan, cursor and arrival of every aircraft live in
+    NumPy arrays indexed by aircraft, and Aircraft objects are thin views over
+    one row. Moving all aircraft one tick and checking whether all of them
+    have arrived are single vectorized operations.
+'''
+import numpy as np
+
+from agents.path import ticks_per_cell
+
+class Fleet:
+    def __init__(self, speed, history_length=-1):
+        '''
+            speed: distance an aircraft travels in one tick
+            history_length: number of past positions kept per aircraft, -1 means all
+        '''
+        self.speed = speed
+        self.S = ticks_per_cell(speed)
+        self.history_length = history_length
+        self.aircraft = []
+        self.size = 0
+
+        # Number of calls of move(), telling whether positions changed
+        self.ticks = 0
+
+        # Positions as (x, y) and as points of a path, see agents/path.py
+        self.position = np.zeros((0, 2))
+        self.point = np.zeros((0, 2), dtype=np.int64)
+        self.goal = np.zeros((0, 2), dtype=np.int64)
+        self.orientation = np.zeros((0, 2), dtype=np.int64)
+        self.arrived = np.zeros(0, dtype=bool)
+
+        # Indices of the aircraft still flying
+        self.active = np.zeros(0, dtype=np.int64)
+
+        # Plans stacked into one array padded with -1, their lengths and the
+        # cursors pointing at the next point to move to
+        self.plans = np.full((0, 1, 2), -1, dtype=np.int32)
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.cursor = np.zeros(0, dtype=np.int64)
+
+        # Coordinates of the points of paths, rounded as by agents.path.to_position
+        self.coordinates = np.zeros(0)
+
+        # Past positions of every aircraft in a ring buffer of {history_length}
+        # rows (growing if unbounded), and the number of positions appended
+        self.history = np.zeros((history_length if history_length >= 0 else 64, 0, 2))
+        self.moves = np.zeros(0, dtype=np.int64)
+
+    def add(self, aircraft, source, destination):
+        '''
+            Add a row for {aircraft} flying from {source} to {destination}.
+            Returns the index of the row.
+        '''
+        if self.size == len(self.position):
+            self.grow(max(2 * self.size, 4))
+        index = self.size
+        self.size += 1
+        self.aircraft.append(aircraft)
+        self.position[index] = source
+        self.point[index] = np.array(source) * self.S
+        self.goal[index] = np.array(destination) * self.S
+        self.active = np.flatnonzero(~self.arrived[:self.size])
+        return index
+
+    def grow(self, capacity):
+        # Reallocate every array for {capacity} aircraft
+        def resize(array, fill=0, axis=0):
+            shape = list(array.shape)
+            shape[axis] = capacity
+            grown = np.full(shape, fill, dtype=array.dtype)
+            grown[(slice(None),) * axis + (slice(array.shape[axis]),)] = array
+            return grown
+        self.position = resize(self.position)
+        self.point = resize(self.point)
+        self.goal = resize(self.goal)
+        self.orientation = resize(self.orientation)
+        self.arrived = resize(self.arrived, False)
+        self.plans = resize(self.plans, -1)
+        self.lengths = resize(self.lengths)
+        self.cursor = resize(self.cursor)
+        self.history = resize(self.history, axis=1)
+        self.moves = resize(self.moves)
+
+    def set_plan(self, index, plan):
+        '''
+            Replace the plan of aircraft {index} and reset its cursor.
+        '''
+        if len(plan) > self.plans.shape[1]:
+            plans = np.full((len(self.plans), max(len(plan), 2 * self.plans.shape[1]), 2), -1, dtype=np.int32)
+            plans[:, :self.plans.shape[1]] = self.plans
+            self.plans = plans
+        self.plans[index, :len(plan)] = plan
+        self.plans[index, len(plan):] = -1
+        self.lengths[index] = len(plan)
+        self.cursor[index] = 0
+
+        if len(plan) > 0 and plan.max() >= len(self.coordinates):
+            self.coordinates = np.round(np.arange(2 * plan.max() + 1) * self.speed, 2)
+
+    @property
+    def eta(self):
+        '''
+            Estimated time of arrival of every aircraft.
+        '''
+        return self.lengths[:self.size] - self.cursor[:self.size]
+
+    def all_arrived(self):
+        return len(self.active) == 0
+
+    def move(self, indices=None):
+        '''
+            Let the aircraft {indices}, all by default, move for one timestep. Aircraft
+            reaching their destination change their state {arrived}.
+        '''
+        if indices is None:
+            indices = self.active
+        else:
+            indices = np.asarray(indices, dtype=np.int64)
+            indices = indices[~self.arrived[indices]]
+        if len(indices) == 0:
+            return
+        cursor = self.cursor[indices]
+        remaining = self.lengths[indices] - cursor
+        shortest = remaining.min()
+        assert shortest > 0
+        moves = self.moves[indices]
+        if self.history_length != 0:
+            self.record_history(indices, moves)
+
+        # Orientation towards the next point, kept on the last step
+        point = self.point[indices]
+        target = self.plans[indices, cursor]
+        if shortest >= 2:
+            self.orientation[indices] = target - point
+        else:
+            turning = remaining >= 2
+            self.orientation[indices[turning]] = (target - point)[turning]
+        self.point[indices] = target
+        self.position[indices] = self.coordinates[target]
+        self.cursor[indices] = cursor + 1
+        self.moves[indices] = moves + 1
+        self.ticks += 1
+
+        # Plans end at the destination
+        if shortest == 1:
+            arrived = indices[remaining == 1]
+            assert (self.point[arrived] == self.goal[arrived]).all()
+            self.arrived[arrived] = True
+            self.active = np.flatnonzero(~self.arrived[:self.size])
+
+    def advance(self, ticks):
+        '''
+            Let all aircraft move for {ticks} timesteps at once, ending in the same
+            state as {ticks} calls of move().
+        '''
+        indices = self.active
+        if len(indices) == 0:
+            return
+        cursor = self.cursor[indices]
+        lengths = self.lengths[indices]
+        remaining = lengths - cursor
+        assert remaining.min() > 0
+        steps = np.minimum(remaining, ticks)
+        point = self.point[indices]
+        if self.history_length != 0:
+            self.record_passed(indices, cursor, steps, point)
+
+        # Orientation of the last step that was not the last one of the plan
+        last = cursor + steps - 1
+        turn = np.minimum(last, lengths - 2)
+        turning = turn >= cursor
+        before = np.where((turn > cursor)[:, None], self.plans[indices, np.maximum(turn - 1, 0)], point)
+        self.orientation[indices[turning]] = (self.plans[indices, np.maximum(turn, 0)] - before)[turning]
+
+        target = self.plans[indices, last]
+        self.point[indices] = target
+        self.position[indices] = self.coordinates[target]
+        self.cursor[indices] = cursor + steps
+        self.moves[indices] += steps
+        self.ticks += 1
+
+        arrived = indices[steps == remaining]
+        if len(arrived) > 0:
+            assert (self.point[arrived] == self.goal[arrived]).all()
+            self.arrived[arrived] = True
+            self.active = np.flatnonzero(~self.arrived[:self.size])
+
+    def points_after(self, ticks):
+        '''
+            ticks: (K,) numbers of ticks from now
+            -----------------------------------------------
+            Where the aircraft still flying now will be after every number of {ticks}
+            if they keep their plans: (K, A, 2) points, and a (K, A) mask of the
+            aircraft that have not arrived by then.
+        '''
+        indices = self.active
+        cursor = self.cursor[indices]
+        remaining = self.lengths[indices] - cursor
+        steps = np.minimum(ticks[:, None], remaining)
+        points = np.where((steps > 0)[..., None], self.plans[indices, np.maximum(cursor + steps - 1, 0)],
+                          self.point[indices])
+        return points, ticks[:, None] < remaining
+
+    def record_history(self, indices, moves):
+        # Unbounded: grow geometrically so that appending stays amortized O(1)
+        if self.history_length == -1 and moves.max() >= len(self.history):
+            self.history = np.concatenate([self.history, np.zeros_like(self.history)])
+        self.history[moves % len(self.history), indices] = self.position[indices]
+
+    def record_passed(self, indices, cursor, steps, point):
+        # History of advance(): the current point, then the plan up to the point before the last
+        moves = self.moves[indices]
+        offsets = np.arange(int(steps.max()))
+        kept = offsets[None, :] < steps[:, None]
+        if self.history_length > 0:
+            kept &= offsets[None, :] >= (steps - self.history_length)[:, None]
+        while self.history_length == -1 and (moves + steps).max() > len(self.history):
+            self.history = np.concatenate([self.history, np.zeros_like(self.history)])
+        rows, columns = np.nonzero(kept)
+        offset = offsets[columns]
+        passed = np.where((offset == 0)[:, None], point[rows],
+                          self.plans[indices[rows], cursor[rows] + offset - 1])
+        self.history[(moves[rows] + offset) % len(self.history), indices[rows]] = self.coordinates[passed]
+
+class FleetHistory:
+    '''
+        Positions an aircraft of a Fleet has passed, oldest first, as read by
+        agents.render.ZoneRenderer: the number of positions appended so far
+        ({total}), iteration over the kept ones and since().
+    '''
+    def __init__(self, fleet, index):
+        self.fleet = fleet
+        self.index = index
+
+    @property
+    def total(self):
+        # Number of positions appended so far
+        return int(self.fleet.moves[self.index])
+
+    def __len__(self):
+        capacity = self.fleet.history_length
+        return self.total if capacity == -1 else min(self.total, capacity)
+
+    def __iter__(self):
+        return iter(self.since(0))
+
+    def since(self, count):
+        '''
+            The kept positions appended after the first {count} ones, oldest first.
+        '''
+        total = self.total
+        start = max(count, total - len(self))
+        if start >= total:
+            return np.zeros((0, 2))
+        history = self.fleet.history
+        return history[np.arange(start, total) % len(history), self.index]
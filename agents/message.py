@@ -0,0 +1,25 @@
+class Message:
+    '''
+        Status broadcast by an aircraft. Messages are never modified: a changed
+        status is broadcast as a new message with a higher version, and an
+        unchanged one as the same message, so receivers tell whether anything
+        changed by comparing versions. The path is a read-only view of the
+        sender's plan, shared by reference, starting at the sender's cursor.
+    '''
+    __slots__ = ['id', 'version', 'x', 'y', 'orientation', 'eta', 'path', 'arrived', 'dest',
+                 'recognized_priority', 'plan', 'cursor']
+
+    def __init__(self, id, version, x, y, orientation, eta, path, arrived, dest, recognized_priority,
+                 plan=None, cursor=0):
+        self.id = id
+        self.version = version
+        self.x = x
+        self.y = y
+        self.orientation = orientation
+        self.eta = eta
+        self.path = path
+        self.arrived = arrived
+        self.dest = dest
+        self.recognized_priority = recognized_priority
+        self.plan = plan
+        self.cursor = cursor
@@ -0,0 +1,105 @@
+'''
+    Paths are (T, 2) integer arrays of positions counted in units of the aircraft
+    speed, i.e. in the distance an aircraft travels in one tick. Positions can be
+    compared exactly and paths take a fraction of the memory of lists of float tuples.
+    The helpers below convert between this representation and (x, y) positions.
+'''
+import functools
+
+import numpy as np
+
+def ticks_per_cell(speed):
+    '''
+        Number of ticks an aircraft needs to cross one cell.
+    '''
+    return int(round(1 / speed))
+
+def to_ticks(positions, speed):
+    '''
+        Convert a list of (x, y) positions into a path.
+    '''
+    if len(positions) == 0:
+        return np.zeros((0, 2), dtype=np.int32)
+    return np.rint(np.asarray(positions, dtype=np.float64) / speed).astype(np.int32)
+
+def to_position(point, speed):
+    '''
+        Convert a single point of a path into an (x, y) position.
+    '''
+    return round(int(point[0]) * speed, 2), round(int(point[1]) * speed, 2)
+
+def to_positions(path, speed):
+    '''
+        Convert a path into a list of (x, y) positions.
+    '''
+    return [to_position(point, speed) for point in path]
+
+def straight(begin, end):
+    '''
+        begin, end: points of a path sharing either their x or their y coordinate
+        -----------------------------------------------
+        The points an aircraft passes moving straight from {begin} to {end},
+        {begin} excluded and {end} included.
+    '''
+    if begin[0] == end[0] and begin[1] == end[1]:
+        return np.zeros((0, 2), dtype=np.int32)
+    axis = 0 if begin[0] != end[0] else 1
+    direction = 1 if end[axis] > begin[axis] else -1
+    segment = np.empty((abs(int(end[axis]) - int(begin[axis])), 2), dtype=np.int32)
+    segment[:, axis] = np.arange(begin[axis] + direction, end[axis] + direction, direction)
+    segment[:, 1 - axis] = begin[1 - axis]
+    return segment
+
+@functools.lru_cache(maxsize=4096)
+def default_segment(begin, end):
+    '''
+        begin, end: (x, y) tuples of points of a path
+        -----------------------------------------------
+        The shortest path from {begin} to {end}, {begin} excluded: first along the
+        axis with the larger delta, then along the other one. Points are counted in
+        ticks, so they already account for the speed. Segments are read-only and
+        shared between callers; the least recently used ones are dropped beyond
+        maxsize. Hits and misses are reported by default_segment.cache_info().
+    '''
+    begin = np.array(begin)
+    end = np.array(end)
+    if abs(begin[0] - end[0]) > abs(begin[1] - end[1]):
+        corner = np.array([end[0], begin[1]])
+    else:
+        corner = np.array([begin[0], end[1]])
+    segment = np.concatenate([straight(begin, corner), straight(corner, end)])
+    segment.setflags(write=False)
+    return segment
+
+def default_paths(begins, ends, length):
+    '''
+        begins, ends: (N, 2) arrays of points of paths
+        -----------------------------------------------
+        The first {length} points of the default segments (see default_segment())
+        from every point of {begins} to the one of {ends}, computed at once and
+        stacked into an (N, length, 2) int32 array padded with -1. Returns the
+        array and the lengths of the whole segments.
+    '''
+    begins = np.asarray(begins, dtype=np.int32)
+    ends = np.asarray(ends, dtype=np.int32)
+    delta = np.abs(ends - begins)
+    corners = np.where((delta[:, 0] > delta[:, 1])[:, None],
+                       np.stack([ends[:, 0], begins[:, 1]], axis=1),
+                       np.stack([begins[:, 0], ends[:, 1]], axis=1))
+    lengths = delta.sum(axis=1)
+
+    # Steps along the first leg up to the corner, then along the second one
+    steps = np.arange(1, length + 1, dtype=np.int32)[None, :]
+    along = np.minimum(steps, np.abs(corners - begins).sum(axis=1)[:, None])
+    beyond = steps - along
+    padding = steps > lengths[:, None]
+    first = np.sign(corners - begins)
+    second = np.sign(ends - corners)
+    points = np.empty((len(begins), length, 2), dtype=np.int32)
+    for axis in range(2):
+        point = points[..., axis]
+        np.multiply(first[:, axis, None], along, out=point)
+        point += second[:, axis, None] * beyond
+        point += begins[:, axis, None]
+        point[padding] = -1
+    return points, lengths
@@ -0,0 +1,354 @@
+'''
+    Planners search the cells of the air zone for a path of an aircraft to its
+    destination that keeps clear of the aircraft of higher priority.
+    A search state is a cell together with the orientation the aircraft entered
+    it with. States are encoded as single integers, so that the visited states
+    fit in one flat bitmap that is allocated once and reused by every search.
+    Moves are checked against a table of the cells and moves reserved by the
+    aircraft of higher priority.
+'''
+import heapq
+
+from agents.path import ticks_per_cell
+
+# Unit moves, indexed by their orientation id
+MOVES = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+ORIENTATION_ID = {move: n for n, move in enumerate(MOVES)}
+
+def preferences(cur_x, cur_y, dest_x, dest_y):
+    '''
+        Moves from (cur_x, cur_y) in the order they are tried, the ones heading
+        for (dest_x, dest_y) first.
+    '''
+    dx = abs(cur_x - dest_x)
+    dy = abs(cur_y - dest_y)
+
+    if cur_x < dest_x and cur_y < dest_y:
+        if dx > dy:
+            outp = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+        else:
+            outp = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+
+    if cur_x > dest_x and cur_y < dest_y:
+        if dx > dy:
+            outp = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+        else:
+            outp = [(0, 1), (-1, 0), (0, -1), (1, 0)]
+
+    if cur_x < dest_x and cur_y > dest_y:
+        if dx > dy:
+            outp = [(1, 0), (0, -1), (-1, 0), (0, 1)]
+        else:
+            outp = [(0, -1), (1, 0), (0, -1), (1, 0)]
+
+    if cur_x > dest_x and cur_y > dest_y:
+        if dx > dy:
+            outp = [(-1, 0), (0, -1), (1, 0), (0, 1)]
+        else:
+            outp = [(0, -1), (-1, 0), (0, 1), (1, 0)]
+
+    if cur_x == dest_x:
+        if cur_y > dest_y:
+            outp = [(0, -1), (-1, 0), (1, 0), (0, 1)]
+        else:
+            outp = [(0, 1), (-1, 0), (1, 0), (0, -1)]
+
+    if cur_y == dest_y:
+        if cur_x > dest_x:
+            outp = [(-1, 0), (0, -1), (0, 1), (1, 0)]
+        else:
+            outp = [(1, 0), (0, -1), (0, 1), (-1, 0)]
+
+    return outp
+
+class ReservationTable:
+    '''
+        Space-time reservations of the aircraft of higher priority, so that the
+        safety of a move is checked with a few set lookups instead of scanning
+        every constraint path. Each aircraft reserves
+        - (t, x, y): the cell it occupies at step t,
+        - (t, x, y, new_x, new_y): the move from (x, y) to (new_x, new_y) at step t
+          that would swap cells with it,
+        - (x, y, new_x, new_y): the move into its current cell while it moves
+          to (x, y), at any step.
+        The reservations of an aircraft are kept as long as its message does
+        not change, so that consecutive searches only add or release the
+        reservations of the aircraft whose messages differ.
+    '''
+    def __init__(self):
+        self.S = None
+        # Aircraft id -> (message, its vertex, edge and entry reservations)
+        self.held = {}
+        # Reservation -> number of aircraft holding it
+        self.vertices = {}
+        self.edges = {}
+        self.entries = {}
+
+    def clear(self):
+        self.held.clear()
+        self.vertices.clear()
+        self.edges.clear()
+        self.entries.clear()
+
+    def hold(self, constraints, S):
+        '''
+            constraints: {aircraft id: message} of every aircraft of higher priority
+            S: number of ticks per cell
+            -----------------------------------------------
+            Make the table hold the reservations of exactly {constraints}.
+        '''
+        if S != self.S:
+            self.clear()
+            self.S = S
+        for id in [id for id, held in self.held.items() if constraints.get(id) is not held[0]]:
+            self.release(id)
+        for id, msg in constraints.items():
+            if id not in self.held:
+                self.reserve(id, msg)
+
+    def reserve(self, id, msg):
+        S = self.S
+        path = msg.path.tolist()
+
+        def cell(point):
+            # Cell a point of a path lies on, None between cells
+            if point[0] % S != 0 or point[1] % S != 0:
+                return None
+            return point[0] // S, point[1] // S
+
+        # Cell at the end of every step the path covers
+        cells = [cell(path[S * t - 1]) for t in range(1, len(path) // S + 1)]
+
+        vertices = [(t + 1,) + c for t, c in enumerate(cells) if c is not None]
+        edges = [(t + 1,) + cells[t] + cells[t - 1] for t in range(1, len(cells))
+                 if cells[t] is not None and cells[t - 1] is not None]
+        # At the first step, the end of the path stands in for the previous cell
+        if len(path) >= 2 * S and cells[0] is not None and cell(path[-1]) is not None:
+            edges.append((1,) + cells[0] + cell(path[-1]))
+        entries = []
+        if len(cells) > 0 and cells[0] is not None:
+            entries.append(cells[0] + (int(msg.x), int(msg.y)))
+
+        for reservations, keys in [(self.vertices, vertices), (self.edges, edges), (self.entries, entries)]:
+            for key in keys:
+                reservations[key] = reservations.get(key, 0) + 1
+        self.held[id] = (msg, vertices, edges, entries)
+
+    def release(self, id):
+        _, vertices, edges, entries = self.held.pop(id)
+        for reservations, keys in [(self.vertices, vertices), (self.edges, edges), (self.entries, entries)]:
+            for key in keys:
+                if reservations[key] == 1:
+                    del reservations[key]
+                else:
+                    reservations[key] -= 1
+
+    def is_safe(self, x, y, new_x, new_y, t):
+        '''
+            Whether moving from cell (x, y) to cell (new_x, new_y), arriving at
+            step {t}, keeps clear of all reservations.
+        '''
+        return (t, new_x, new_y) not in self.vertices and \
+               (t, x, y, new_x, new_y) not in self.edges and \
+               (x, y, new_x, new_y) not in self.entries
+
+class Planner:
+    '''
+        Base class of the planners. Subclasses implement search().
+        {expansions} counts the states expanded by all searches, {last_expansions}
+        the ones expanded by the latest search.
+    '''
+    name = None
+
+    def __init__(self):
+        self.visited = bytearray()
+        self.cleared = b''
+        self.reservations = ReservationTable()
+        self.searches = 0
+        self.expansions = 0
+        self.last_expansions = 0
+
+    def reset(self, w, h):
+        '''
+            Clear the visited bitmap for an air zone of size {w} x {h},
+            reallocating it only if the size changed.
+        '''
+        size = (w + 1) * (h + 1) * 4
+        if len(self.visited) != size:
+            self.visited = bytearray(size)
+            self.cleared = bytes(size)
+        else:
+            self.visited[:] = self.cleared
+
+    def plan(self, aircraft):
+        '''
+            aircraft: aircraft to plan for. The aircraft before it in its priority
+                      list are avoided, as last heard of in its received messages.
+            -----------------------------------------------
+            Returns the cells from the current cell of {aircraft} to its destination,
+            or None if no safe path arrives within its time budget.
+        '''
+        priority = aircraft.recognized_priority
+        constraints = {cid: aircraft.recv_msg[cid] for cid in priority[:priority.index(aircraft.id)]}
+        self.reservations.hold(constraints, ticks_per_cell(aircraft.speed))
+
+        # Paths taking longer than this are not considered as good solutions
+        budget = aircraft.eta + aircraft.num_acs * 2 - 2
+
+        self.reset(aircraft.zone_w, aircraft.zone_h)
+        self.last_expansions = 0
+        cells = self.search((int(aircraft.x), int(aircraft.y)), tuple(aircraft.orientation),
+                            tuple(aircraft.destination), budget, aircraft.zone_w, aircraft.zone_h,
+                            self.reservations.is_safe)
+        self.searches += 1
+        self.expansions += self.last_expansions
+        return cells
+
+    def search(self, start, orientation, dest, budget, w, h, safe):
+        '''
+            start, dest: (x, y) cells
+            orientation: (dx, dy) orientation at {start}, U-turns are not allowed
+            budget: maximum number of steps to {dest}
+            w, h: size of the air zone
+            safe: safe(x, y, new_x, new_y, t) tells whether a move arriving at step t is allowed
+            -----------------------------------------------
+            Returns the cells from {start} to {dest}, or None.
+        '''
+        raise NotImplementedError
+
+    @staticmethod
+    def encode(x, y, orientation_id, h):
+        return ((x * (h + 1) + y) << 2) | orientation_id
+
+    @staticmethod
+    def trace(cells, parents, node):
+        path = []
+        while node != -1:
+            path.append(cells[node])
+            node = parents[node]
+        return path[::-1]
+
+class BFSPlanner(Planner):
+    '''
+        Breadth-first search: states are expanded in the order they are found and
+        a state is only visited the first time it is found.
+    '''
+    name = 'bfs'
+
+    def search(self, start, orientation, dest, budget, w, h, safe):
+        dest_x, dest_y = dest
+        visited = self.visited
+
+        # Nodes in the order they are found: cell, orientation, step and parent node
+        cells = [start]
+        orientations = [orientation]
+        steps = [0]
+        parents = [-1]
+
+        ptr = 0
+        while ptr < len(cells):
+            x, y = cells[ptr]
+            if x == dest_x and y == dest_y:
+                return self.trace(cells, parents, ptr)
+            self.last_expansions += 1
+            o_x, o_y = orientations[ptr]
+            t = steps[ptr] + 1
+
+            for move in preferences(x, y, dest_x, dest_y):
+                # Aircrafts are not allowed to make U-turns
+                if move[0] + o_x == 0 and move[1] + o_y == 0:
+                    continue
+                new_x = x + move[0]
+                new_y = y + move[1]
+
+                # Bound check
+                if new_x < 0 or new_x > w or new_y < 0 or new_y > h:
+                    continue
+
+                # Visited states are not considered
+                key = self.encode(new_x, new_y, ORIENTATION_ID[move], h)
+                if visited[key]:
+                    continue
+
+                if not safe(x, y, new_x, new_y, t):
+                    continue
+
+                # Cost pruning
+                if t + abs(new_x - dest_x) + abs(new_y - dest_y) > budget:
+                    continue
+
+                cells.append((new_x, new_y))
+                orientations.append(move)
+                steps.append(t)
+                parents.append(ptr)
+                visited[key] = 1
+            ptr += 1
+        return None
+
+class AStarPlanner(Planner):
+    '''
+        A* search on a heap ordered by steps taken plus the Manhattan distance
+        to the destination, which never overestimates the steps left. Among
+        equally promising states the deeper one is expanded first, then the
+        one found first. A state is closed when it is expanded.
+    '''
+    name = 'astar'
+
+    def search(self, start, orientation, dest, budget, w, h, safe):
+        dest_x, dest_y = dest
+        visited = self.visited
+
+        cells = [start]
+        orientations = [orientation]
+        steps = [0]
+        parents = [-1]
+
+        # (estimated total steps, -steps taken, node)
+        heap = [(abs(start[0] - dest_x) + abs(start[1] - dest_y), 0, 0)]
+        while heap:
+            _, _, node = heapq.heappop(heap)
+            x, y = cells[node]
+            if x == dest_x and y == dest_y:
+                return self.trace(cells, parents, node)
+
+            # Skip states already expanded at an earlier or equal step
+            o_x, o_y = orientations[node]
+            orientation_id = ORIENTATION_ID.get((o_x, o_y))
+            if orientation_id is not None:
+                key = self.encode(x, y, orientation_id, h)
+                if visited[key]:
+                    continue
+                visited[key] = 1
+            self.last_expansions += 1
+            t = steps[node] + 1
+
+            for move in preferences(x, y, dest_x, dest_y):
+                # Aircrafts are not allowed to make U-turns
+                if move[0] + o_x == 0 and move[1] + o_y == 0:
+                    continue
+                new_x = x + move[0]
+                new_y = y + move[1]
+
+                # Bound check
+                if new_x < 0 or new_x > w or new_y < 0 or new_y > h:
+                    continue
+
+                if visited[self.encode(new_x, new_y, ORIENTATION_ID[move], h)]:
+                    continue
+
+                if not safe(x, y, new_x, new_y, t):
+                    continue
+
+                # Cost pruning, the heuristic is exact without other aircraft
+                estimate = t + abs(new_x - dest_x) + abs(new_y - dest_y)
+                if estimate > budget:
+                    continue
+
+                cells.append((new_x, new_y))
+                orientations.append(move)
+                steps.append(t)
+                parents.append(node)
+                heapq.heappush(heap, (estimate, -t, len(cells) - 1))
+        return None
+
+PLANNERS = {planner.name: planner for planner in [BFSPlanner, AStarPlanner]}
@@ -0,0 +1,95 @@
+'''
+    Low-overhead instrumentation of the simulation loop. A Simulation created
+    with a PhaseProfile measures the time spent in every phase of every tick with
+    time.perf_counter_ns() and counts the work done. Without one, nothing is
+    measured.
+'''
+import csv
+import json
+import time
+
+# Phases of a tick, 'render' covers the observers called at the start of each tick
+PHASES = ['render', 'SB', 'IC', 'PD', 'CD', 'RP', 'M']
+PHASE_ID = {phase: n for n, phase in enumerate(PHASES)}
+
+# expansions: states expanded by the planner
+# messages: messages delivered during IC and RP
+# replans: RP phases, i.e. cycles in which a collision was foreseen
+# redos: RP rounds ending in a dead end
+# dead_end_aircraft: aircraft for which RP failed, summed over all rounds
+COUNTERS = ['expansions', 'messages', 'replans', 'redos', 'dead_end_aircraft']
+
+class PhaseProfile:
+    '''
+        Nanoseconds spent in every phase of every tick, and counters.
+    '''
+    def __init__(self):
+        self.ticks = []
+        self.current = None
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def begin_tick(self):
+        self.current = [0] * len(PHASES)
+        self.ticks.append(self.current)
+
+    def add(self, phase, start):
+        '''
+            Charge the time since {start} to {phase}, returns the current time.
+        '''
+        now = time.perf_counter_ns()
+        self.current[PHASE_ID[phase]] += now - start
+        return now
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+
+    def totals(self):
+        '''
+            Nanoseconds spent in every phase over all ticks.
+        '''
+        return {phase: sum(tick[n] for tick in self.ticks) for n, phase in enumerate(PHASES)}
+
+    def summary(self):
+        return {'ticks': len(self.ticks), 'phases_ns': self.totals(), 'counters': dict(self.counters)}
+
+    def write(self, prefix):
+        '''
+            Write the time of every phase of every tick to {prefix}.csv and the
+            totals and counters to {prefix}.json.
+        '''
+        with open(f'{prefix}.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['tick'] + [f'{phase}_ns' for phase in PHASES])
+            for tick, row in enumerate(self.ticks):
+                writer.writerow([tick] + row)
+        with open(f'{prefix}.json', 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+def write_summary(path, summaries):
+    '''
+        path: file the table is written to
+        summaries: PhaseProfile.summary() of every profiled test
+        -----------------------------------------------
+        Write a table of the time spent in every phase and of the counters,
+        summed over all tests.
+    '''
+    totals = dict.fromkeys(PHASES, 0)
+    counters = dict.fromkeys(COUNTERS, 0)
+    ticks = 0
+    for summary in summaries:
+        ticks += summary['ticks']
+        for phase in PHASES:
+            totals[phase] += summary['phases_ns'][phase]
+        for counter in COUNTERS:
+            counters[counter] += summary['counters'][counter]
+
+    total = sum(totals.values())
+    with open(path, 'w') as f:
+        f.write(f'{len(summaries)} tests, {ticks} ticks\n\n')
+        f.write(f'{"phase":<8}{"total ms":>12}{"us/tick":>12}{"share":>9}\n')
+        for phase in PHASES:
+            f.write(f'{phase:<8}{totals[phase] / 1e6:>12.1f}{totals[phase] / 1e3 / max(ticks, 1):>12.2f}'
+                    f'{totals[phase] / max(total, 1):>9.1%}\n')
+        f.write(f'{"total":<8}{total / 1e6:>12.1f}{total / 1e3 / max(ticks, 1):>12.2f}{1:>9.1%}\n\n')
+        for counter in COUNTERS:
+            f.write(f'{counter:<18}{counters[counter]:>12}\n')
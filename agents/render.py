@@ -0,0 +1,212 @@
+import os
+import shutil
+import queue
+import threading
+import numpy as np
+import cv2
+
+from agents.path import ticks_per_cell
+
+class ZoneRenderer:
+    '''
+        Draws an air zone and any number of aircraft into a single uint8 image.
+        The grid and the border never change, so they are rendered once per zone
+        size and shared by all renderers. All aircraft are drawn straight into one
+        frame, and history dots are drawn incrementally into a shared layer, which
+        is redrawn when dots drop out of a capped history. Memory use does not
+        depend on the number of aircraft.
+    '''
+    # (w, h, zoom_ratio) -> static background
+    static_cache = {}
+
+    # Opacity of the danger zones, which may overlap each other
+    danger_zone_alpha = 0.5
+
+    def __init__(self, w, h, zoom_ratio):
+        self.w = w
+        self.h = h
+        self.zoom_ratio = zoom_ratio
+
+        key = (w, h, zoom_ratio)
+        if key not in ZoneRenderer.static_cache:
+            ZoneRenderer.static_cache[key] = self.render_static()
+        self.background = ZoneRenderer.static_cache[key]
+
+        # History dots of all aircraft and where they have been drawn
+        self.history = np.zeros_like(self.background)
+        self.history_mask = np.zeros(self.background.shape[:2], dtype=np.uint8)
+
+        # Aircraft index -> number of history dots drawn, and dropped from a capped history
+        self.history_drawn = {}
+        self.history_dropped = {}
+
+    def render_static(self):
+        '''
+            Render the parts of the figure that never change: the grey frame
+            around the air zone, the grid and the border.
+        '''
+        z = self.zoom_ratio
+        shape = ((self.h + 2) * z, (self.w + 2) * z, 3)
+
+        # Backgrounds
+        background = np.full(shape, 100, dtype=np.uint8)
+        background[z - 30:-z + 31, z - 30:-z + 31] = 255
+
+        # Grid and border
+        for i in range(1, self.h):
+            cv2.line(background, (z, z * (1 + i)), (z * (1 + self.w) + 1, z * (1 + i)), [200, 200, 200], 2)
+        for i in range(1, self.w):
+            cv2.line(background, (z * (1 + i), z), (z * (1 + i), z * (1 + self.h) + 1), [200, 200, 200], 2)
+        cv2.line(background, (z, z), (z, z * (1 + self.h) + 1), [130, 130, 130], 2)
+        cv2.line(background, (z, z * (1 + self.h) + 1), (z * (1 + self.w) + 1, z * (1 + self.h) + 1), [130, 130, 130], 2)
+        cv2.line(background, (z * (1 + self.w) + 1, z * (1 + self.h) + 1), (z * (1 + self.w) + 1, z), [130, 130, 130], 2)
+        cv2.line(background, (z * (1 + self.w) + 1, z), (z, z), [130, 130, 130], 2)
+
+        return background
+
+    def draw_dots(self, canvas, centers, color, mask=None):
+        z = self.zoom_ratio
+        for center in centers:
+            cv2.circle(canvas, center, int(0.04 * z), color, int(0.04 * z), cv2.LINE_8)
+            if mask is not None:
+                cv2.circle(mask, center, int(0.04 * z), 255, int(0.04 * z), cv2.LINE_8)
+
+    def update_history(self, aclist):
+        '''
+            Draw the history dots added since the last frame.
+        '''
+        z = self.zoom_ratio
+
+        # An aircraft has been reset or replaced, or dots dropped out of its capped
+        # history: start over from the kept dots
+        redraw = False
+        for idx, ac in enumerate(aclist):
+            dropped = ac.path_history.total - len(ac.path_history)
+            if self.history_drawn.get(idx, 0) > ac.path_history.total or \
+               dropped > self.history_dropped.get(idx, 0):
+                redraw = True
+            self.history_dropped[idx] = dropped
+        if redraw:
+            self.history[:] = 0
+            self.history_mask[:] = 0
+            self.history_drawn = {}
+
+        for idx, ac in enumerate(aclist):
+            drawn = self.history_drawn.get(idx, 0)
+            centers = [(int((x + 1) * z), int((y + 1) * z)) for x, y in ac.path_history.since(drawn)]
+            self.draw_dots(self.history, centers, ac.history_color, self.history_mask)
+            self.history_drawn[idx] = ac.path_history.total
+
+    def render(self, aclist):
+        '''
+            Plot the air zone and the planes in it.
+        '''
+        z = self.zoom_ratio
+        canvas = self.background.copy()
+
+        # Danger zones are blended in, so overlapping zones stay visible
+        for ac in aclist:
+            if not ac.arrived:
+                zone = canvas[int((ac.y + 0.5) * z):int((ac.y + 1.5) * z) + 1,
+                              int((ac.x + 0.5) * z):int((ac.x + 1.5) * z) + 1]
+                zone[:] = zone * (1 - ZoneRenderer.danger_zone_alpha) + \
+                          np.array(ac.danger_zone_color) * ZoneRenderer.danger_zone_alpha
+
+        # Destinations
+        for ac in aclist:
+            dest_x, dest_y = ac.destination
+            canvas[(dest_y + 1) * z - 10:(dest_y + 1) * z + 11,
+                   (dest_x + 1) * z - 10:(dest_x + 1) * z + 11] = ac.dest_color
+
+        # Past and future paths
+        self.update_history(aclist)
+        cv2.copyTo(self.history, self.history_mask, canvas)
+        for ac in aclist:
+            # Paths count ticks, see agents/path.py
+            centers = ac.path * z // ticks_per_cell(ac.speed) + z
+            self.draw_dots(canvas, centers.tolist(), ac.path_color)
+
+        # Aircraft and their communication ranges
+        for ac in aclist:
+            cv2.rectangle(canvas,
+                          (int((ac.x - 1.1) * z), int((ac.y - 1.1) * z)),
+                          (int((ac.x + 3.1) * z), int((ac.y + 3.1) * z)),
+                          ac.disp_color,
+                          1,
+                          cv2.LINE_AA)
+            cv2.circle(canvas,
+                       (int((ac.x + 1) * z), int((ac.y + 1) * z)),
+                       int(0.1 * z),
+                       ac.disp_color,
+                       int(0.1 * z),
+                       cv2.LINE_AA)
+
+        # Nothing is drawn on the grey frame around the air zone
+        canvas[:z - 30] = self.background[:z - 30]
+        canvas[-z + 31:] = self.background[-z + 31:]
+        canvas[:, :z - 30] = self.background[:, :z - 30]
+        canvas[:, -z + 31:] = self.background[:, -z + 31:]
+
+        return canvas
+
+class FrameDumper:
+    '''
+        Writes frames to disk as JPEG images on a background thread.
+        The queue is bounded, so a slow disk throttles the simulation instead
+        of buffering an unbounded number of frames in memory.
+    '''
+    def __init__(self, frame_dir, max_pending=64):
+        self.frame_dir = frame_dir
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, tick, frame):
+        self.pending.put((tick, frame))
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            tick, frame = item
+            cv2.imwrite(f'{self.frame_dir}/{tick}.jpg', frame)
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+
+class VideoObserver:
+    '''
+        Renders the air zone after every tick and records it as a video.
+        Attach it to a simulation to get visual output; leave it out to run headless.
+        Frames go straight to the video encoder, they are only written to disk
+        as well if {dump_frames} is True.
+    '''
+    def __init__(self, zone, out_dir, mode, video_name, dump_frames=False):
+        os.makedirs(f'{out_dir}/{mode}', exist_ok=True)
+        self.vw = cv2.VideoWriter(f"{out_dir}/{video_name}",
+                                  cv2.VideoWriter_fourcc("m", "p", "4", "v"),
+                                  5,
+                                  (zone.zoom_ratio * (zone.w + 2), zone.zoom_ratio * (zone.h + 2)),
+                                  True)
+
+        # Optional side channel writing every frame as an image
+        self.dumper = None
+        if dump_frames:
+            frame_dir = f'{out_dir}/{mode}/frames'
+            shutil.rmtree(frame_dir, ignore_errors=True)
+            os.makedirs(frame_dir, exist_ok=True)
+            self.dumper = FrameDumper(frame_dir)
+
+    def observe(self, zone, tick):
+        # Plot current air zone
+        canvas = zone.show()
+        self.vw.write(canvas)
+        if self.dumper is not None:
+            self.dumper.put(tick, canvas)
+
+    def close(self):
+        self.vw.release()
+        if self.dumper is not None:
+            self.dumper.close()
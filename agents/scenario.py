@@ -0,0 +1,232 @@
+import math
+import os
+import numpy as np
+
+from agents.aircraft import Aircraft
+from agents.conflict import conflict_times, detect_conflict_steps, earliest, stack_paths
+from agents.path import default_paths
+from agents.zone import ZoneSpec
+
+class ConflictTable:
+    '''
+        Default paths of all valid routes between boundary positions of an air zone
+        and the first steps at which every pair of them conflicts. The table only
+        depends on the zone size and Aircraft.speed, so it is cached on disk and
+        loaded instead of regenerating and comparing the paths.
+    '''
+    # Bump when the layout of the cached file or the conflict semantics change
+    version = 1
+
+    # Zones with more routes compute conflicts on demand instead, see ScenarioGenerator
+    max_routes = 4096
+
+    def __init__(self, routes, paths, lengths, same_first, swap_first):
+        '''
+            routes: (R, 2, 2) source and destination of every route
+            paths: (R, T, 2) default paths stacked and padded with -1, lengths: their lengths
+            same_first: (R, R) first step at which two paths occupy the same position, -1 if never
+            swap_first: (R, R) first step at which two paths swap positions, -1 if never
+        '''
+        self.routes = routes
+        self.paths = paths
+        self.lengths = lengths
+        self.same_first = same_first
+        self.swap_first = swap_first
+
+        # Earliest conflict of every pair and the conflict flags
+        self.first = earliest(same_first, swap_first)
+        self.conflict = self.first >= 0
+
+        # Route lookup by (source, destination)
+        self.index = {(tuple(begin), tuple(end)): n for n, (begin, end) in enumerate(self.routes.tolist())}
+
+    @classmethod
+    def build(cls, zone, speed):
+        '''
+            Enumerate the valid routes of {zone} and compare the default paths
+            of aircraft flying at {speed}.
+        '''
+        positions = zone.boundary_positions()
+        routes = [(begin, end) for begin in positions for end in positions
+                  if zone.is_valid_route(begin, end)]
+        # Aircraft.speed is a class attribute shared by all aircraft
+        default_speed = Aircraft.speed
+        Aircraft.speed = speed
+        try:
+            paths = [Aircraft(0, begin, end, 1, zone.w, zone.h).path for begin, end in routes]
+        finally:
+            Aircraft.speed = default_speed
+        same_first, swap_first = detect_conflict_steps(paths)
+        stacked, lengths = stack_paths(paths)
+        return cls(np.array(routes, dtype=np.int32), stacked, lengths, same_first, swap_first)
+
+    @staticmethod
+    def cache_path(zone, speed, cache_dir):
+        return os.path.join(cache_dir, f'conflicts_{zone.w}x{zone.h}_{speed}.npz')
+
+    @classmethod
+    def load(cls, zone, speed=None, cache_dir='results/cache'):
+        '''
+            zone: air zone whose size and boundary positions are used
+            speed: aircraft speed, defaults to Aircraft.speed
+            cache_dir: directory of the cached tables, None disables the cache
+            -----------------------------------------------
+            Load the table of {zone} from {cache_dir}, building and saving it
+            if it is missing or outdated.
+        '''
+        speed = Aircraft.speed if speed is None else speed
+        if cache_dir is None:
+            return cls.build(zone, speed)
+
+        path = cls.cache_path(zone, speed, cache_dir)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                if int(data['version']) == cls.version:
+                    return cls(data['routes'], data['paths'], data['lengths'],
+                               data['same_first'], data['swap_first'])
+
+        table = cls.build(zone, speed)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first so that concurrent readers never see a partial table
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, version=cls.version, routes=table.routes, paths=table.paths,
+                 lengths=table.lengths, same_first=table.same_first, swap_first=table.swap_first)
+        os.replace(tmp_path, path)
+        return table
+
+    def route(self, begin, end):
+        '''
+            Index of the route from {begin} to {end}, None if it is not in the table.
+        '''
+        return self.index.get((tuple(begin), tuple(end)))
+
+    def path(self, route):
+        '''
+            Default path of {route}.
+        '''
+        return self.paths[route, :self.lengths[route]]
+
+class ScenarioGenerator:
+    '''
+        Generates scenarios whose aircraft are guaranteed to conflict, without
+        rejection sampling whole air zones.
+        All valid routes between boundary positions are enumerated once. A
+        scenario is then built one aircraft at a time, only choosing among routes
+        that conflict with enough of the aircraft chosen so far. Only the conflicts
+        of the chosen routes with all routes are needed: they are read from a
+        conflict table if there is one, and computed when first needed otherwise.
+    '''
+    # Routes compared at once when computing conflicts
+    chunk_size = 1024
+
+    def __init__(self, zone, table=None):
+        '''
+            zone: air zone whose size and boundary positions are used
+            table: ConflictTable of the zone, None computes the conflicts of chosen routes on demand
+        '''
+        self.zone = zone
+        self.w = zone.w
+        self.h = zone.h
+        self.table = table
+
+        # Every valid (source, destination) route, in the order of the conflict table
+        positions = zone.boundary_positions()
+        self.routes = [(begin, end) for begin in positions for end in positions
+                       if zone.is_valid_route(begin, end)]
+        source_ids = {position: n for n, position in enumerate(positions)}
+        self.sources = np.array([source_ids[begin] for begin, _ in self.routes])
+        self.route_cells = np.array(self.routes, dtype=np.int64).reshape(-1, 2, 2)
+
+        # Route -> conflicts with all routes, as computed by conflicts(). Cleared
+        # beyond about 256 MB.
+        self.columns = {}
+        self.max_columns = max(1, 2 ** 28 // max(len(self.routes), 1))
+
+        # Acceptance statistics
+        self.attempts = 0
+        self.accepted = 0
+
+    def conflicts(self, route):
+        '''
+            Whether the default path of {route} conflicts with that of every route.
+            Routes sharing its source, which are never chosen together, conflict with
+            it but are left out when not read from the conflict table.
+        '''
+        if self.table is not None:
+            return self.table.conflict[:, route]
+        if route in self.columns:
+            return self.columns[route]
+
+        # Aircraft leave and reach cells at the same ticks, take more than one tick
+        # per cell and only turn on cells, so two default paths meet or swap between
+        # ticks if and only if they meet or swap between cells: the paths are
+        # compared cell by cell, starting at their sources. Cells of the other paths
+        # past the end of this one are never compared.
+        routes = self.route_cells
+        length = int(np.abs(routes[route, 1] - routes[route, 0]).sum())
+        own, own_len = self.cell_paths(routes[[route]], length)
+        column = np.empty(len(self.routes), dtype=bool)
+        for start in range(0, len(self.routes), self.chunk_size):
+            others, others_len = self.cell_paths(routes[start:start + self.chunk_size], length)
+            column[start:start + self.chunk_size] = conflict_times(own, own_len, others, others_len)[0] >= 0
+        column[self.sources == self.sources[route]] = False
+
+        if len(self.columns) >= self.max_columns:
+            self.columns.clear()
+        self.columns[route] = column
+        return column
+
+    @staticmethod
+    def cell_paths(routes, length):
+        # Sources and the first {length} cells of the default paths of {routes}
+        paths, lengths = default_paths(routes[:, 0], routes[:, 1], length)
+        return np.concatenate([routes[:, :1].astype(np.int32), paths], axis=1), lengths + 1
+
+    def generate(self, num_aircrafts, rng, density=1.0, max_attempts=10000):
+        '''
+            num_aircrafts: number of aircraft in the scenario
+            rng: random.Random instance the scenario is drawn with
+            density: fraction of the aircraft chosen before that every new aircraft
+                     must conflict with, 1.0 makes all pairs conflict and 0 draws
+                     routes uniformly
+            max_attempts: number of dead ends after which the density is considered unreachable
+            -----------------------------------------------
+            Returns the ZoneSpec of a scenario in which no two aircraft share a source.
+        '''
+        for _ in range(max_attempts):
+            self.attempts += 1
+            chosen = []
+            available = np.ones(len(self.routes), dtype=bool)
+            # Number of chosen routes every route conflicts with
+            conflicts = np.zeros(len(self.routes), dtype=np.int64)
+            for k in range(num_aircrafts):
+                candidates = available
+                if k > 0 and density > 0:
+                    candidates = available & (conflicts >= math.ceil(density * k))
+                candidates = np.flatnonzero(candidates)
+
+                # Dead end: start over
+                if len(candidates) == 0:
+                    break
+
+                route = int(candidates[rng.randrange(len(candidates))])
+                chosen.append(route)
+                if density > 0 and k < num_aircrafts - 1:
+                    conflicts += self.conflicts(route)
+
+                # No two aircraft share the same source
+                available &= self.sources != self.sources[route]
+            else:
+                self.accepted += 1
+                return ZoneSpec(num_aircrafts, tuple(self.routes[route] for route in chosen), self.w, self.h)
+
+        raise RuntimeError(f'No scenario with {num_aircrafts} aircraft and conflict density {density} '
+                           f'found in {max_attempts} attempts')
+
+    def stats(self):
+        return {
+            'routes': len(self.routes),
+            'attempts': self.attempts,
+            'accepted': self.accepted,
+            'acceptance_rate': self.accepted / self.attempts if self.attempts > 0 else 0.0
+        }
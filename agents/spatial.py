@@ -0,0 +1,40 @@
+class SpatialGrid:
+    '''
+        Uniform grid index over the integer cells aircraft positions live on.
+        Answers which aircraft are within communication range of an aircraft
+        by only looking at the cells around it instead of at the whole air zone.
+        The index holds the positions aircraft had when they were inserted, so
+        Zone builds a new one whenever the fleet has moved.
+    '''
+    def __init__(self):
+        # (cell_x, cell_y) -> {aircraft id: aircraft}
+        self.cells = {}
+
+    def cell(self, x, y):
+        # Positions are never negative, so truncation is the floor
+        return int(x), int(y)
+
+    def insert(self, aircraft):
+        self.cells.setdefault(self.cell(aircraft.x, aircraft.y), {})[aircraft.id] = aircraft
+
+    def query(self, aircraft, radius):
+        '''
+            Return the other aircraft within Chebyshev distance {radius} of {aircraft}
+            (the distance truncated to an integer, as in Aircraft.inRange), ordered by id.
+        '''
+        cell_x, cell_y = self.cell(aircraft.x, aircraft.y)
+
+        # Truncation admits distances up to radius + 1 (exclusive), which may span
+        # radius + 1 cells in every direction
+        reach = radius + 1
+        neighbors = []
+        for i in range(cell_x - reach, cell_x + reach + 1):
+            for j in range(cell_y - reach, cell_y + reach + 1):
+                bucket = self.cells.get((i, j))
+                if bucket is None:
+                    continue
+                for other in bucket.values():
+                    if other is not aircraft and aircraft.inRange(other):
+                        neighbors.append(other)
+        neighbors.sort(key=lambda other: other.id)
+        return neighbors
@@ -1,157 +1,152 @@
 import random
-import numpy as np
-import cv2
+from collections import namedtuple
 
 from agents.aircraft import Aircraft
+from agents.fleet import Fleet
+from agents.render import ZoneRenderer
+from agents.spatial import SpatialGrid
+
+# Scenario definition of an air zone, see Zone.snapshot()
+ZoneSpec = namedtuple('ZoneSpec', ['num_aircrafts', 'aclist', 'w', 'h'], defaults=[10, 10])
 
 class Zone:
     zoom_ratio = 60
-    def __init__(self, num_aircrafts, random_gen=True, aclist=None):
+    def __init__(self, num_aircrafts, random_gen=True, aclist=None, w=10, h=10):
         # Air zone size
-        self.h = 10
-        self.w = 10
+        self.h = h
+        self.w = w
+
+        # Renderer, created on the first call of show()
+        self.renderer = None
 
         # Whether aircrafts are generated randomly
         if random_gen:
             self.aclist = self.gen_aircrafts(num_aircrafts)
+            self.index_aircrafts()
         else:
             assert aclist is not None and len(aclist) == num_aircrafts
-            self.aclist = []
-            for i in range(len(aclist)):
-                src = aclist[i][0]
-                dest = aclist[i][1]
-                self.aclist.append(Aircraft(i, src, dest, num_aircrafts, self.w, self.h))
+            self.place_aircrafts(aclist)
+
+    @classmethod
+    def from_spec(cls, spec):
+        '''
+            Build a fresh air zone from a scenario definition made by snapshot().
+        '''
+        return cls(spec.num_aircrafts, random_gen=False, aclist=spec.aclist, w=spec.w, h=spec.h)
+
+    def snapshot(self):
+        '''
+            Capture the scenario definition of the air zone: the source and the
+            destination of every aircraft. The snapshot is small and picklable,
+            and restore() or from_spec() rebuild the air zone from it.
+        '''
+        return ZoneSpec(len(self.aclist),
+                        tuple((tuple(ac.source), tuple(ac.destination)) for ac in self.aclist),
+                        self.w, self.h)
+
+    def restore(self, snapshot):
+        '''
+            Reset the air zone to the scenario captured by snapshot().
+        '''
+        self.w = snapshot.w
+        self.h = snapshot.h
+        self.renderer = None
+        self.place_aircrafts(snapshot.aclist)
+
+    def place_aircrafts(self, aclist):
+        '''
+            aclist: list of (source, destination) pairs
+            -----------------------------------------------
+            Replace the aircraft in the air zone by new ones at their sources.
+        '''
+        self.fleet = Fleet(Aircraft.speed, Aircraft.history_length)
+        self.aclist = []
+        for i in range(len(aclist)):
+            src = aclist[i][0]
+            dest = aclist[i][1]
+            self.aclist.append(Aircraft(i, src, dest, len(aclist), self.w, self.h, self.fleet))
+        self.index_aircrafts()
+
+    def index_aircrafts(self):
+        # Spatial index for finding aircraft within communication range, rebuilt
+        # once aircraft have moved instead of being updated every tick
+        self.grid = SpatialGrid()
+        self.indexed_ticks = self.fleet.ticks
+        for ac in self.aclist:
+            self.grid.insert(ac)
+
+    def neighbors(self, ac):
+        '''
+            Aircraft within communication range of {ac}.
+        '''
+        if self.indexed_ticks != self.fleet.ticks:
+            self.index_aircrafts()
+        return self.grid.query(ac, Aircraft.comm_range)
+
+    def communicate(self):
+        '''
+            IC phase: every aircraft receives the messages broadcast by the
+            aircraft within its communication range, and only those.
+        '''
+        for ac in self.aclist:
+            neighbors = self.neighbors(ac)
+            in_range = {other.id for other in neighbors}
+            for id in [id for id in ac.recv_msg if id not in in_range]:
+                del ac.recv_msg[id]
+            # Messages whose version did not change are kept
+            for other in neighbors:
+                msg = ac.recv_msg.get(other.id)
+                if msg is None or msg.version != other.bc_msg.version:
+                    ac.recv_msg[other.id] = other.bc_msg
 
     def show(self):
         '''
             Plot the air zone and the planes in it.
+            Returns a uint8 BGR image that can be fed to a video writer directly.
         '''
         # 60 unit length in canvas = 1km
+        if self.renderer is None:
+            self.renderer = ZoneRenderer(self.w, self.h, Zone.zoom_ratio)
+        return self.renderer.render(self.aclist)
 
-        # Backgrounds
-        canvas = np.ones(((self.h + 2) * Zone.zoom_ratio, (self.w + 2) * Zone.zoom_ratio, 3), dtype=np.int32) * 100
-        canvas[Zone.zoom_ratio - 30:-Zone.zoom_ratio + 31, Zone.zoom_ratio - 30:-Zone.zoom_ratio + 31] = 255
+    def boundary_positions(self):
+        '''
+            Positions on the border of the air zone where aircraft may enter or leave it.
+        '''
+        return [(0, i) for i in range(1, self.h)] + \
+               [(i, 0) for i in range(1, self.w)] + \
+               [(self.w, i) for i in range(1, self.h)] + \
+               [(i, self.h) for i in range(1, self.w)]
 
-        # Planes
-        ac_components = []
-        for ac in self.aclist:
-            ac_canvas = np.zeros(((self.h + 2) * Zone.zoom_ratio, (self.w + 2) * Zone.zoom_ratio, 3), dtype=np.int32)
-            for i in range(1, self.h):
-                cv2.line(ac_canvas,
-                         (Zone.zoom_ratio, Zone.zoom_ratio * (1 + i)),
-                         (Zone.zoom_ratio * (1 + self.h) + 1, Zone.zoom_ratio * (1 + i)),
-                         [100, 100, 100],
-                         2)
-            for i in range(1, self.w):
-                cv2.line(ac_canvas,
-                         (Zone.zoom_ratio * (1 + i), Zone.zoom_ratio),
-                         (Zone.zoom_ratio * (1 + i), Zone.zoom_ratio * (1 + self.w) + 1),
-                         [100, 100, 100],
-                         2)
-            cv2.line(ac_canvas,
-                     (Zone.zoom_ratio, Zone.zoom_ratio),
-                     (Zone.zoom_ratio, Zone.zoom_ratio * (1 + self.w) + 1),
-                     [30, 30, 30],
-                     2)
-            cv2.line(ac_canvas,
-                     (Zone.zoom_ratio, Zone.zoom_ratio * 11 + 1),
-                     (Zone.zoom_ratio * (1 + self.h) + 1, Zone.zoom_ratio * (1 + self.w) + 1),
-                     [30, 30, 30],
-                     2)
-            cv2.line(ac_canvas,
-                     (Zone.zoom_ratio * (1 + self.h) + 1, Zone.zoom_ratio * (1 + self.w) + 1),
-                     (Zone.zoom_ratio * (1 + self.h) + 1, Zone.zoom_ratio),
-                     [30, 30, 30],
-                     2)
-            cv2.line(ac_canvas,
-                     (Zone.zoom_ratio * (1 + self.h) + 1, Zone.zoom_ratio),
-                     (Zone.zoom_ratio, Zone.zoom_ratio),
-                     [30, 30, 30],
-                     2)
-            if not ac.arrived:
-                ac_canvas[int((ac.y + 0.5) * Zone.zoom_ratio):int((ac.y + 1.5) * Zone.zoom_ratio) + 1, 
-                        int((ac.x + 0.5) * Zone.zoom_ratio):int((ac.x + 1.5) * Zone.zoom_ratio) + 1] = ac.danger_zone_color
-            dest_x, dest_y = ac.destination
-            ac_canvas[(dest_y + 1) * Zone.zoom_ratio - 10:(dest_y + 1) * Zone.zoom_ratio + 11, 
-                      (dest_x + 1) * Zone.zoom_ratio - 10:(dest_x + 1) * Zone.zoom_ratio + 11] = ac.dest_color
-
-            for history_pos in ac.path_history:
-                x, y = history_pos
-                cv2.circle(ac_canvas,
-                           (int((x + 1) * Zone.zoom_ratio), int((y + 1) * Zone.zoom_ratio)),
-                           int(0.04 * Zone.zoom_ratio),
-                           ac.history_color,
-                           int(0.04 * Zone.zoom_ratio),
-                           cv2.LINE_AA)
-            for future_pos in ac.path:
-                x, y = future_pos
-                cv2.circle(ac_canvas,
-                           (int((x + 1) * Zone.zoom_ratio), int((y + 1) * Zone.zoom_ratio)),
-                           int(0.04 * Zone.zoom_ratio),
-                           ac.path_color,
-                           int(0.04 * Zone.zoom_ratio),
-                           cv2.LINE_AA)
-            cv2.rectangle(ac_canvas,
-                          (int((ac.x - 1.1) * Zone.zoom_ratio), int((ac.y - 1.1) * Zone.zoom_ratio)),
-                          (int((ac.x + 3.1) * Zone.zoom_ratio), int((ac.y + 3.1) * Zone.zoom_ratio)),
-                          ac.disp_color,
-                          1,
-                          cv2.LINE_AA)  
-            cv2.circle(ac_canvas, 
-                       (int((ac.x + 1) * Zone.zoom_ratio), int((ac.y + 1) * Zone.zoom_ratio)),
-                       int(0.1 * Zone.zoom_ratio),
-                       ac.disp_color,
-                       int(0.1 * Zone.zoom_ratio),
-                       cv2.LINE_AA)
-            ac_components.append(ac_canvas)
-
-        # Mix plane canvases into a single figure
-        if len(self.aclist) == 2:
-            ac_mask = cv2.addWeighted(ac_components[0], 0.5,
-                                      ac_components[1], 0.5,
-                                      100)
-            ac_mask[ac_mask == 100] = 0
-        if len(self.aclist) == 3:
-            ac_mask = cv2.addWeighted(cv2.addWeighted(ac_components[0], 1/2,
-                                                      ac_components[1], 1/2,
-                                                      0), 2/3,
-                                      ac_components[2], 1/3,
-                                      100)
-            ac_mask[ac_mask == 100] = 0
-        
-        ac_mask[ac_mask > 255] = 255
-        white_mask = np.where(np.sum(ac_mask, 2) == 0)
-        ac_mask[white_mask] = 255
-
-        canvas[Zone.zoom_ratio - 30:-Zone.zoom_ratio + 31, Zone.zoom_ratio - 30:-Zone.zoom_ratio + 31] = \
-            ac_mask[Zone.zoom_ratio - 30:-Zone.zoom_ratio + 31, Zone.zoom_ratio - 30:-Zone.zoom_ratio + 31]
-
-        return canvas
+    def is_valid_route(self, begin_pos, end_pos):
+        '''
+            To make things nontrivial, begin and end position must not appear on
+            the same side of the air zone.
+        '''
+        if begin_pos[0] == 0 and end_pos[0] == 0:
+            return False
+        if begin_pos[0] == self.w and end_pos[0] == self.w:
+            return False
+        if begin_pos[1] == 0 and end_pos[1] == 0:
+            return False
+        if begin_pos[1] == self.h and end_pos[1] == self.h:
+            return False
+        return True
 
     def gen_aircrafts(self, num_aircrafts):
         '''
             Randomly generate airplanes.
         '''
+        self.fleet = Fleet(Aircraft.speed, Aircraft.history_length)
         aircraft_list = []
-        position_list = [(0, i) for i in range(1, self.h)] + \
-                        [(i, 0) for i in range(1, self.w)] + \
-                        [(self.w, i) for i in range(1, self.h)] + \
-                        [(i, self.h) for i in range(1, self.w)]
+        position_list = self.boundary_positions()
         for id in range(num_aircrafts):
             # Generate begin and end points for each aircrafts
             while True:
                 begin_pos = random.choice(position_list)
                 end_pos = random.choice(position_list)
 
-                # To make things nontrivial, assert begin and end position 
-                # do not appear on the same side of the ir zone
-                if begin_pos[0] == 0 and end_pos[0] == 0:
-                    continue
-                if begin_pos[0] == self.w and end_pos[0] == self.h:
-                    continue
-                if begin_pos[1] == 0 and end_pos[1] == 0:
-                    continue
-                if begin_pos[1] == self.h and end_pos[1] == self.h:
+                if not self.is_valid_route(begin_pos, end_pos):
                     continue
 
                 # Assert that no two aircrafts share the same begin position
@@ -164,7 +159,8 @@ class Zone:
                     if not valid:
                         continue
 
-                aircraft_list.append(Aircraft(id, begin_pos, end_pos, num_aircrafts, self.w, self.h))
+                aircraft_list.append(Aircraft(id, begin_pos, end_pos, num_aircrafts, self.w, self.h,
+                                              self.fleet))
                 break
             
         return aircraft_list
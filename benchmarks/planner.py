@@ -0,0 +1,46 @@
+'''
+    States expanded and time taken by the planners of agents/planner.py, replanning
+    the same aircraft around the same aircraft of higher priority in air zones
+    of growing size.
+    Run from the repository root: python -m benchmarks.planner
+'''
+import random
+import time
+
+from agents.aircraft import Aircraft
+from agents.planner import PLANNERS
+
+def gen_problems(size, num_aircrafts, num_problems, seed=0):
+    '''
+        {num_problems} aircraft crossing a {size} x {size} air zone from left to right,
+        each with {num_aircrafts} aircraft of higher priority crossing from top to bottom.
+    '''
+    rng = random.Random(seed)
+    problems = []
+    for _ in range(num_problems):
+        others = []
+        for id in range(num_aircrafts):
+            x = rng.randrange(1, size)
+            others.append(Aircraft(id, (x, 0), (rng.randrange(1, size), size), num_aircrafts + 1, size, size))
+        ac = Aircraft(num_aircrafts, (0, rng.randrange(1, size)), (size, rng.randrange(1, size)),
+                      num_aircrafts + 1, size, size)
+        for other in others:
+            other.broadcast()
+            ac.recv_msg[other.id] = other.bc_msg
+        ac.recognized_priority = [other.id for other in others] + [ac.id]
+        problems.append(ac)
+    return problems
+
+def bench(planner, problems):
+    start = time.perf_counter()
+    solved = sum(planner.plan(ac) is not None for ac in problems)
+    elapsed = time.perf_counter() - start
+    return planner.expansions / len(problems), elapsed / len(problems) * 1000, solved
+
+if __name__ == '__main__':
+    for size in [10, 30, 60]:
+        problems = gen_problems(size, 5, 50)
+        for name, planner in PLANNERS.items():
+            expansions, elapsed, solved = bench(planner(), problems)
+            print(f'{size:3d}x{size:<3d} {name:6s}: {expansions:9.1f} states/search, '
+                  f'{elapsed:8.3f} ms/search, {solved}/{len(problems)} solved')
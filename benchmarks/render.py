@@ -0,0 +1,85 @@
+'''
+    Per-frame render time of Zone.show() before and after caching the static layer
+    and drawing all aircraft into a single frame.
+    Run from the repository root: python -m benchmarks.render
+'''
+import random
+import time
+import numpy as np
+import cv2
+
+from agents.zone import Zone
+from agents.path import to_positions
+
+def legacy_show(zone):
+    '''
+        The renderer before caching: one full-size int32 canvas per aircraft with
+        the grid and the border redrawn on each of them, averaged into one figure.
+    '''
+    z = Zone.zoom_ratio
+    canvas = np.ones(((zone.h + 2) * z, (zone.w + 2) * z, 3), dtype=np.int32) * 100
+    canvas[z - 30:-z + 31, z - 30:-z + 31] = 255
+
+    ac_components = []
+    for ac in zone.aclist:
+        ac_canvas = np.zeros(((zone.h + 2) * z, (zone.w + 2) * z, 3), dtype=np.int32)
+        for i in range(1, zone.h):
+            cv2.line(ac_canvas, (z, z * (1 + i)), (z * (1 + zone.w) + 1, z * (1 + i)), [100, 100, 100], 2)
+        for i in range(1, zone.w):
+            cv2.line(ac_canvas, (z * (1 + i), z), (z * (1 + i), z * (1 + zone.h) + 1), [100, 100, 100], 2)
+        cv2.line(ac_canvas, (z, z), (z, z * (1 + zone.h) + 1), [30, 30, 30], 2)
+        cv2.line(ac_canvas, (z, z * (1 + zone.h) + 1), (z * (1 + zone.w) + 1, z * (1 + zone.h) + 1), [30, 30, 30], 2)
+        cv2.line(ac_canvas, (z * (1 + zone.w) + 1, z * (1 + zone.h) + 1), (z * (1 + zone.w) + 1, z), [30, 30, 30], 2)
+        cv2.line(ac_canvas, (z * (1 + zone.w) + 1, z), (z, z), [30, 30, 30], 2)
+        if not ac.arrived:
+            ac_canvas[int((ac.y + 0.5) * z):int((ac.y + 1.5) * z) + 1,
+                      int((ac.x + 0.5) * z):int((ac.x + 1.5) * z) + 1] = ac.danger_zone_color
+        dest_x, dest_y = ac.destination
+        ac_canvas[(dest_y + 1) * z - 10:(dest_y + 1) * z + 11,
+                  (dest_x + 1) * z - 10:(dest_x + 1) * z + 11] = ac.dest_color
+        for x, y in ac.path_history:
+            cv2.circle(ac_canvas, (int((x + 1) * z), int((y + 1) * z)), int(0.04 * z), ac.history_color, int(0.04 * z))
+        for x, y in to_positions(ac.path, ac.speed):
+            cv2.circle(ac_canvas, (int((x + 1) * z), int((y + 1) * z)), int(0.04 * z), ac.path_color, int(0.04 * z))
+        cv2.rectangle(ac_canvas, (int((ac.x - 1.1) * z), int((ac.y - 1.1) * z)),
+                      (int((ac.x + 3.1) * z), int((ac.y + 3.1) * z)), ac.disp_color, 1)
+        cv2.circle(ac_canvas, (int((ac.x + 1) * z), int((ac.y + 1) * z)), int(0.1 * z), ac.disp_color, int(0.1 * z))
+        ac_components.append(ac_canvas)
+
+    ac_mask = sum(ac_components) // len(ac_components) + 100
+    ac_mask[ac_mask == 100] = 0
+    ac_mask[ac_mask > 255] = 255
+    ac_mask[np.where(np.sum(ac_mask, 2) == 0)] = 255
+    canvas[z - 30:-z + 31, z - 30:-z + 31] = ac_mask[z - 30:-z + 31, z - 30:-z + 31]
+    return canvas.astype(np.uint8)
+
+def gen_zone(num_aircrafts, seed=0):
+    '''
+        Random air zone with {num_aircrafts} aircraft. Sources may be shared,
+        which does not matter for rendering.
+    '''
+    random.seed(seed)
+    position_list = [(0, i) for i in range(1, 10)] + [(10, i) for i in range(1, 10)]
+    aclist = []
+    for _ in range(num_aircrafts):
+        src = random.choice(position_list)
+        aclist.append([src, (10 - src[0], random.randrange(1, 10))])
+    return Zone(num_aircrafts=num_aircrafts, random_gen=False, aclist=aclist)
+
+def bench(show, num_aircrafts, num_frames):
+    zone = gen_zone(num_aircrafts)
+    elapsed = 0
+    for _ in range(num_frames):
+        start = time.perf_counter()
+        show(zone)
+        elapsed += time.perf_counter() - start
+        for ac in zone.aclist:
+            ac.move()
+    return elapsed / num_frames * 1000
+
+if __name__ == '__main__':
+    for num_aircrafts in [3, 50, 200]:
+        before = bench(legacy_show, num_aircrafts, 40)
+        after = bench(Zone.show, num_aircrafts, 40)
+        print(f'{num_aircrafts:3d} aircraft: before {before:8.2f} ms/frame, '
+              f'after {after:8.2f} ms/frame, speedup {before / after:5.1f}x')
@@ -0,0 +1,230 @@
+'''
+    Benchmark suite over a fixed corpus of seeded scenarios. Times the whole
+    engine headless, rendering only, the planner in isolation and conflict
+    detection in isolation, writes the timings as JSON and fails when one of
+    them is slower than the stored baseline by more than a threshold. Timings
+    are stored as multiples of a calibration loop timed right before every
+    benchmark, so that the baseline holds on faster or slower machines and
+    while the speed of the machine drifts during a run.
+    Run from the repository root:
+        python -m benchmarks.suite                      compare against benchmarks/baseline.json
+        python -m benchmarks.suite --update-baseline    store the timings as the new baseline
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from agents.aircraft import Aircraft
+from agents.conflict import detect_conflicts
+from agents.engine import Simulation
+from agents.planner import PLANNERS
+from agents.scenario import ConflictTable, ScenarioGenerator
+from agents.zone import Zone
+
+# A scenario of the corpus. 200 aircraft need more than the 196 boundary positions
+# of a 50 x 50 air zone, as no two aircraft share a source, so they fly in a 100 x 100 one.
+# Only the 10 x 10 zone has a conflict table small enough to force conflicts.
+Scenario = namedtuple('Scenario', ['name', 'w', 'h', 'num_aircrafts', 'density', 'planner', 'seed'])
+
+CORPUS = [
+    Scenario('3ac_10x10', 10, 10, 3, 1.0, 'bfs', 0),
+    Scenario('10ac_10x10', 10, 10, 10, 0, 'bfs', 1),
+    Scenario('3ac_50x50', 50, 50, 3, 0, 'astar', 2),
+    Scenario('50ac_50x50', 50, 50, 50, 0, 'astar', 3),
+    Scenario('200ac_100x100', 100, 100, 200, 0, 'astar', 4),
+]
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+def gen_spec(scenario):
+    zone = Zone(num_aircrafts=0, random_gen=False, aclist=[], w=scenario.w, h=scenario.h)
+    # Not cached, the suite leaves no files behind
+    table = ConflictTable.load(zone, cache_dir=None) if scenario.density > 0 else None
+    generator = ScenarioGenerator(zone, table)
+    return generator.generate(scenario.num_aircrafts, random.Random(scenario.seed), scenario.density)
+
+def best_of(repeats, run, min_time=0.05):
+    '''
+        Wall time of one call of {run}. Fast calls are timed in batches of at
+        least {min_time} seconds, and the best of {repeats} batches is kept as
+        the one least disturbed by other processes.
+    '''
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    best = elapsed / number
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def calibration_loop():
+    # Fixed mix of interpreted code and small NumPy calls, as in the engine
+    total = 0
+    for i in range(20000):
+        total += i % 7
+    values = np.arange(1000)
+    for _ in range(200):
+        values = (values * 3 + 1) % 1009
+    return total + int(values[0])
+
+def calibrate(repeats):
+    '''
+        Seconds per call of calibration_loop(), the unit timings are compared in.
+    '''
+    return best_of(max(repeats, 5), calibration_loop)
+
+def bench_engine(spec, repeats):
+    '''
+        Seconds per headless run of the whole scenario.
+    '''
+    def run():
+        # The engine reports dead ends on stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            Simulation(spec).run()
+    return best_of(repeats, run)
+
+def bench_render(spec, repeats, num_frames=5):
+    '''
+        Seconds per rendered frame, aircraft moving along their default paths.
+    '''
+    def run():
+        zone = Zone.from_spec(spec)
+        for _ in range(num_frames):
+            zone.show()
+            zone.fleet.move()
+    return best_of(repeats, run) / num_frames
+
+def planning_problems(spec):
+    '''
+        Every aircraft of the scenario, replanning around all aircraft of lower id
+        as they broadcast at the start.
+    '''
+    zone = Zone.from_spec(spec)
+    for ac in zone.aclist:
+        ac.broadcast()
+    for ac in zone.aclist:
+        ac.recv_msg = {other.id: other.bc_msg for other in zone.aclist[:ac.id]}
+        ac.recognized_priority = [other.id for other in zone.aclist[:ac.id + 1]]
+    return zone.aclist[1:]
+
+def bench_planner(spec, planner, repeats):
+    '''
+        Seconds per search of {planner}.
+    '''
+    problems = planning_problems(spec)
+    def run():
+        for ac in problems:
+            planner.plan(ac)
+    return best_of(repeats, run) / max(len(problems), 1)
+
+def bench_conflicts(spec, repeats):
+    '''
+        Seconds per detection of the conflicts between all default paths.
+    '''
+    paths = [ac.path for ac in Zone.from_spec(spec).aclist]
+    return best_of(repeats, lambda: detect_conflicts(paths))
+
+def run_suite(corpus, repeats):
+    '''
+        Returns {benchmark name: timing in calibrations}, and the fastest
+        calibration in seconds under 'calibration'.
+    '''
+    results = {}
+    calibrations = []
+    def record(key, bench, *args):
+        calibration = calibrate(repeats)
+        seconds = bench(*args)
+        calibrations.append(calibration)
+        results[key] = seconds / calibration
+        print(f'{key:<40}{seconds * 1000:>12.3f} ms{results[key]:>12.3f} cal', flush=True)
+
+    for scenario in corpus:
+        spec = gen_spec(scenario)
+        Aircraft.planner = PLANNERS[scenario.planner]()
+        # Large scenarios take long enough to be timed once
+        n = repeats if scenario.num_aircrafts <= 50 else 1
+
+        record(f'engine/{scenario.name}/{scenario.planner}', bench_engine, spec, n)
+        record(f'render/{scenario.name}', bench_render, spec, n)
+        for name, planner in PLANNERS.items():
+            record(f'planner/{scenario.name}/{name}', bench_planner, spec, planner(), n)
+        record(f'conflicts/{scenario.name}', bench_conflicts, spec, repeats)
+    results['calibration'] = min(calibrations)
+    return results
+
+def compare(results, baseline, threshold, min_delta=0.001):
+    '''
+        Names of the benchmarks slower than their baseline by more than {threshold},
+        e.g. 0.25 for 25%, and by more than {min_delta} seconds at the speed of the
+        fastest calibration, with the ratio of their timings.
+    '''
+    regressions = []
+    for key, timing in results.items():
+        if key == 'calibration' or key not in baseline:
+            continue
+        if timing > baseline[key] * (1 + threshold) and \
+           (timing - baseline[key]) * results['calibration'] > min_delta:
+            regressions.append((key, timing / baseline[key]))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=5, help='timings per benchmark, the best one is kept')
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help='allowed slowdown compared with the baseline, 0.5 means 50%%')
+    parser.add_argument('--min-delta', type=float, default=0.001,
+                        help='smallest slowdown in seconds reported as a regression')
+    parser.add_argument('--quick', action='store_true', help='skip the scenarios with more than 50 aircraft')
+    parser.add_argument('--output', default=None, help='JSON file the timings are written to')
+    parser.add_argument('--baseline', default=BASELINE, help='JSON file of the stored baseline timings')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store the timings as the new baseline instead of comparing')
+    args = parser.parse_args()
+
+    corpus = [scenario for scenario in CORPUS if not args.quick or scenario.num_aircrafts <= 50]
+    results = run_suite(corpus, args.repeats)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'Baseline written to {args.baseline}')
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, run with --update-baseline first')
+        sys.exit(0)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold, args.min_delta)
+    for key, ratio in regressions:
+        print(f'REGRESSION {key}: {ratio:.2f}x the baseline')
+    if len(regressions) > 0:
+        sys.exit(1)
+    print(f'No benchmark slower than the baseline by more than {args.threshold:.0%}')
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+
+from agents.planner import PLANNERS
+
+def load_config(path):
+    '''
+        Read an experiment configuration from a JSON, YAML or TOML file. Keys are
+        the option names of main.py with underscores, e.g.
+            {"zone_width": 100, "zone_height": 100, "aircrafts": 200, "density": 0}
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.json':
+        with open(path) as f:
+            config = json.load(f)
+    elif ext in ['.yaml', '.yml']:
+        try:
+            import yaml
+        except ImportError:
+            raise RuntimeError(f'Reading {path} requires PyYAML, install it with pip install pyyaml')
+        with open(path) as f:
+            config = yaml.safe_load(f) or {}
+    elif ext == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            raise RuntimeError(f'Reading {path} requires Python 3.11 or later')
+        with open(path, 'rb') as f:
+            config = tomllib.load(f)
+    else:
+        raise ValueError(f'Unknown configuration format {ext}, expected .json, .yaml, .yml or .toml')
+    if not isinstance(config, dict):
+        raise ValueError(f'{path} must contain a mapping of option names to values')
+    return config
+
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default=None,
+                        help='JSON, YAML or TOML file setting any of the options below, '
+                             'options given on the command line take precedence')
+
+    # Experiment
+    parser.add_argument('--zone-width', type=int, default=10, help='width of the air zone in cells')
+    parser.add_argument('--zone-height', type=int, default=10, help='height of the air zone in cells')
+    parser.add_argument('--aircrafts', type=int, default=3, help='number of aircraft in every case')
+    parser.add_argument('--cases', type=int, default=1000, help='number of simulated cases')
+    parser.add_argument('--forecast-lengths', type=int, nargs='+', default=[-1] + list(range(1, 11)),
+                        help='forecast lengths every case is tested with, -1 means full length')
+    parser.add_argument('--seed', type=int, default=0, help='seed for case generation')
+    parser.add_argument('--density', type=float, default=None,
+                        help='fraction of the other aircraft every aircraft must conflict with, '
+                             '0 draws routes uniformly, by default every aircraft conflicts with '
+                             'all others if there are up to 3 and with at least 2 otherwise')
+    parser.add_argument('--history-length', type=int, default=-1,
+                        help='number of past positions kept per aircraft, -1 means all')
+    parser.add_argument('--planner', choices=sorted(PLANNERS), default='bfs',
+                        help='search used to plan paths around aircraft of higher priority')
+
+    # Execution and output
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes, 0 means one per CPU core')
+    parser.add_argument('--output-dir', default='results', help='directory results are written to')
+    parser.add_argument('--headless', action='store_true',
+                        help='only record metrics, skip rendering and per-frame disk I/O')
+    parser.add_argument('--render-cases', type=int, nargs='*', default=[],
+                        help='case ids to render even in headless mode')
+    parser.add_argument('--dump-frames', action='store_true',
+                        help='also write every rendered frame as an image')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the cases completed by an interrupted run with the same settings, '
+                             'as recorded in <output-dir>/checkpoint.jsonl')
+    parser.add_argument('--profile', action='store_true',
+                        help='measure the time of every phase of every tick, written to <output-dir>/profile '
+                             'per test and summed up in <output-dir>/profile.txt')
+    parser.add_argument('--profile-case', type=int, default=None,
+                        help='case id whose tests are run under cProfile, dumped to <output-dir>/profile')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='rebuild the conflict table instead of loading it from <output-dir>/cache')
+    return parser
+
+def parse_args(argv=None):
+    '''
+        Parse the command line of main.py. Values of the configuration file
+        given by --config replace the defaults, the command line overrides both.
+    '''
+    parser = build_parser()
+    args, _ = parser.parse_known_args(argv)
+    if args.config is not None:
+        config = load_config(args.config)
+        known = {action.dest for action in parser._actions}
+        unknown = sorted(set(config) - known)
+        if len(unknown) > 0:
+            parser.error(f'unknown options in {args.config}: {", ".join(unknown)}')
+        parser.set_defaults(**config)
+    args = parser.parse_args(argv)
+
+    if args.zone_width < 2 or args.zone_height < 2:
+        parser.error('the air zone must be at least 2 x 2 cells')
+    if args.aircrafts < 1:
+        parser.error('there must be at least one aircraft')
+    if any(steps == 0 or steps < -1 for steps in args.forecast_lengths):
+        parser.error('forecast lengths must be positive or -1')
+
+    # No two aircraft share a source on the border of the air zone
+    sources = 2 * (args.zone_width - 1) + 2 * (args.zone_height - 1)
+    if args.aircrafts > sources:
+        parser.error(f'at most {sources} aircraft fit in a {args.zone_width} x {args.zone_height} air zone')
+    if args.density is None:
+        # Scenarios are found quickly at this density for any number of aircraft
+        args.density = min(1.0, 2 / max(args.aircrafts - 1, 1))
+    elif not 0 <= args.density <= 1:
+        parser.error('the density must be between 0 and 1')
+    return args
@@ -1,270 +1,194 @@
-from typing import Type
+import cProfile
+import random
 import numpy as np
-import cv2
 import os
-import shutil
-import copy
+from concurrent.futures import ProcessPoolExecutor
 
 from agents.zone import Zone
 from agents.aircraft import Aircraft
-from results import Recorder
-
-os.makedirs('results', exist_ok=True)
-simulation_id = 0
-
-def willCollide(z, j, k):
-    for i in range(min(len(z.aclist[j].path), len(z.aclist[k].path))):
-        if z.aclist[j].path[i][0] == z.aclist[k].path[i][0] and \
-           z.aclist[j].path[i][1] == z.aclist[k].path[i][1]:
-            return True
-        if i < min(len(z.aclist[j].path), len(z.aclist[k].path)) - 1:
-            if z.aclist[j].path[i+1][0] == z.aclist[k].path[i][0] and \
-               z.aclist[j].path[i+1][1] == z.aclist[k].path[i][1] and \
-               z.aclist[j].path[i][0] == z.aclist[k].path[i+1][0] and \
-               z.aclist[j].path[i][1] == z.aclist[k].path[i+1][1]:  
-                return True
-
-    return False
-
-# Results recorder
-rc = Recorder('results/results.txt')
-
-while simulation_id < 1000:
+from agents.engine import Simulation
+from agents.path import default_segment
+from agents.profiling import PhaseProfile, write_summary
+from agents.scenario import ConflictTable, ScenarioGenerator
+from agents.planner import PLANNERS
+from agents.render import VideoObserver
+from config import parse_args
+from results import Checkpoint, Recorder
+
+def gen_case(simulation_id, seed, generator, num_aircrafts=3, density=1.0):
+    '''
+        Generate the scenario of case {simulation_id}. The random generator is
+        seeded from {seed} and {simulation_id}, so the same case is produced
+        regardless of which cases were generated before it.
+    '''
     # Keep these lines for testing specific cases
-    # aclist = [[(1, 0), (10, 7)], [(0, 9), (10, 4)], [(1, 10), (10, 2)]]
-    # zone = Zone(num_aircrafts=3, random_gen=False, aclist=aclist)
-    zone = Zone(num_aircrafts=3, random_gen=True)
-
-    # Guarantee that there will be many collisions (if planes are generated randomly) 
-    if not willCollide(zone, 0, 1) or not willCollide(zone, 1, 2) or not willCollide(zone, 0, 2):
-        continue
-
-    print(f"Running case {simulation_id}...")
-
-    # Save the same configuration for the finite-step tests
-    zone_root = copy.deepcopy(zone)
-
-    # Directories to write output figures and videos
-    shutil.rmtree(f'results/{simulation_id}/Full_path/frames', ignore_errors=True)
-    os.makedirs(f'results/{simulation_id}/Full_path', exist_ok=True)
-    os.makedirs(f'results/{simulation_id}/Full_path/frames', exist_ok=True)
-    vw = cv2.VideoWriter(f"results/{simulation_id}/demo_full.mp4",
-                            cv2.VideoWriter_fourcc("m", "p", "4", "v"),
-                            5,
-                            (Zone.zoom_ratio * (zone.w + 2), Zone.zoom_ratio * (zone.h + 2)),
-                            True)
-
-    # Full-length test
-    rc.add_key('Full')
-    print('    Full length test running...')
-
-    # Set clock
-    tick = 0
-
-    while True:
-        # Plot current air zone
-        canvas = zone.show()
-        cv2.imwrite(f'results/{simulation_id}/Full_path/frames/{tick}.jpg', canvas)
-        img = cv2.imread(f'results/{simulation_id}/Full_path/frames/{tick}.jpg')
-        vw.write(img)
-
-        # If all planes have arrived, exit
-        done = True
-        for i in range(len(zone.aclist)):
-            if not zone.aclist[i].arrived:
-                done = False
-        if done:
-            print(f"\tCase {simulation_id} successful.")
-            break
-        
-        # Correspondence and collision avoidance occurs every 5 time steps
-        if tick % 5 == 0:
-            # SB
-            for ac in zone.aclist:
-                ac.broadcast()
-
-            # IC
-            for ac1 in zone.aclist:
-                for ac2 in zone.aclist:
-                    if ac1.id != ac2.id:
-                        ac1.fetch(ac2)
-            
-            # PD
-            for ac in zone.aclist:
-                ac.checkMaxEta()
-            
-            # IC
-            for ac1 in zone.aclist:
-                for ac2 in zone.aclist:
-                    if ac1.id != ac2.id:
-                        ac1.fetch(ac2)
-
-            # CD
-            collision = False
-            for ac in zone.aclist:
-                coll, cid = ac.willCollide()
-                collision = collision or coll
-
-            # RP
-            if collision:
-                # Collision will occur. Each aircraft Modifies its path 
-                # according to priority to avoid collision.
-                all_okay = [False for _ in range(len(zone.aclist))]
-
-                count = 0
-                while count < 3:
-                    for ac1 in zone.aclist:
-                        all_okay[ac1.id] = ac1.modifyPath()
-                        for ac2 in zone.aclist:
-                            if ac1.id != ac2.id:
-                                ac2.fetch(ac1)
-                    if all(all_okay):
-                        break
-
-                    # Dead-end occurs, shuffle priority and redo
-                    print("\tDead end occurs.")
-                    for ac1 in zone.aclist:
-                        for ac2 in zone.aclist:
-                            if ac1.id != ac2.id and not all_okay[ac2.id]:
-                                ac1.fetch(ac2, force_priority=True)
-                    count += 1
-
-                    # 3 redo fails: return with failure
-                    if count == 3:
-                        tick = 50000000
-                        break
-                if tick == 50000000:
-                    rc[key_name].append(tick)
-                    break
-
-        # M
-        for ac in zone.aclist:
-            ac.move()
-
-        tick += 1
-
-    # Record results and do visualization
-    rc['Full'].append(tick * Aircraft.speed)
-    vw.release()
-    cv2.destroyAllWindows()
-    del zone
-
-    # s-step test
-    for s in range(10):
-        steps = s + 1
-
-        # Restore the same case as in full-length
-        zone2 = copy.deepcopy(zone_root)
-        for ac in zone2.aclist:
-            ac.forecast_length = steps
-
-        # Directories to write output figures and videos
-        shutil.rmtree(f'results/{simulation_id}/{steps}_step/frames', ignore_errors=True)
-        os.makedirs(f'results/{simulation_id}/{steps}_step', exist_ok=True)
-        os.makedirs(f'results/{simulation_id}/{steps}_step/frames', exist_ok=True)
-        vw = cv2.VideoWriter(f"results/{simulation_id}/demo_{steps}steps.mp4",
-                                cv2.VideoWriter_fourcc("m", "p", "4", "v"),
-                                5,
-                                (Zone.zoom_ratio * (zone2.w + 2), Zone.zoom_ratio * (zone2.h + 2)),
-                                True)
-
-        # s-step forecast
+    # aclist = (((1, 0), (10, 7)), ((0, 9), (10, 4)), ((1, 10), (10, 2)))
+    # return Zone(3, random_gen=False, aclist=aclist).snapshot()
+
+    # Guarantee that there will be many collisions
+    rng = random.Random(f'{seed}-{simulation_id}')
+    try:
+        return generator.generate(num_aircrafts, rng, density)
+    except RuntimeError as e:
+        raise SystemExit(f'{e}, try a lower --density')
+
+def configure(args):
+    '''
+        Apply the options held in Aircraft class attributes. Worker processes do
+        not run the __main__ block when started with spawn, so every job calls this.
+    '''
+    Aircraft.history_length = args.history_length
+    # Keep the planner between jobs, its buffers are reused
+    if not isinstance(Aircraft.planner, PLANNERS[args.planner]):
+        Aircraft.planner = PLANNERS[args.planner]()
+
+def run_job(job):
+    '''
+        job: (simulation_id, steps, spec, args) tuple, steps == -1 means full-length,
+             spec is the case made by Zone.snapshot(), args are the parsed options
+        -----------------------------------------------
+        Run a single test of one case and return the key its result is recorded
+        under and the SimulationResult. Jobs do not share any state, so they can
+        be run by any worker process in any order. In headless mode frames are only
+        rendered for the cases listed in {args.render_cases}, otherwise the test
+        only produces metrics.
+    '''
+    simulation_id, steps, spec, args = job
+    configure(args)
+
+    # Seed the worker deterministically
+    random.seed(f'{args.seed}-{simulation_id}-{steps}')
+    np.random.seed(random.getrandbits(32))
+
+    if steps == -1:
+        key_name = 'Full'
+        mode = 'Full_path'
+        video_name = 'demo_full.mp4'
+        print(f'    Case {simulation_id}: full length test running...')
+    else:
         key_name = f'{steps}_step'
-        rc.add_key(key_name)
-        print(f'    {steps} step test running...')
-
-        # Set clock
-        tick = 0
-
-        while True:
-            # Plot current air zone
-            canvas = zone2.show()
-            cv2.imwrite(f'results/{simulation_id}/{steps}_step/frames/{tick}.jpg', canvas)
-            img = cv2.imread(f'results/{simulation_id}/{steps}_step/frames/{tick}.jpg')
-            vw.write(img)
-
-            # If all planes have arrived, exit
-            done = True
-            for i in range(len(zone2.aclist)):
-                if not zone2.aclist[i].arrived:
-                    done = False
-            if done:
-                print(f"\tCase {simulation_id} successful.")
-                break
-            
-            # Correspondence and collision avoidance occurs every 5 time steps
-            if tick % 5 == 0:
-                # SB
-                for ac in zone2.aclist:
-                    ac.broadcast()
-
-                # IC
-                for ac1 in zone2.aclist:
-                    for ac2 in zone2.aclist:
-                        if ac1.id != ac2.id:
-                            ac1.fetch(ac2)
-                
-                # PD
-                for ac in zone2.aclist:
-                    ac.checkMaxEta()
-                
-                # IC
-                for ac1 in zone2.aclist:
-                    for ac2 in zone2.aclist:
-                        if ac1.id != ac2.id:
-                            ac1.fetch(ac2)
-
-                # CD
-                collision = False
-                for ac in zone2.aclist:
-                    coll, cid = ac.willCollide()
-                    collision = collision or coll
-
-                # RP
-                if collision:
-                    # Collision will occur. Each aircraft Modifies its path 
-                    # according to priority to avoid collision.
-                    all_okay = [False for _ in range(len(zone2.aclist))]
-
-                    count = 0
-                    while count < 3:
-                        for ac1 in zone2.aclist:
-                            all_okay[ac1.id] = ac1.modifyPath()
-                            for ac2 in zone2.aclist:
-                                if ac1.id != ac2.id:
-                                    ac2.fetch(ac1)
-                        if all(all_okay):
-                            break
-
-                        # Dead-end occurs, shuffle priority and redo
-                        print("\tDead end occurs.")
-                        for ac1 in zone2.aclist:
-                            for ac2 in zone2.aclist:
-                                if ac1.id != ac2.id and not all_okay[ac2.id]:
-                                    ac1.fetch(ac2, force_priority=True)
-                        count += 1
-
-                        # 3 redo fails: return with failure
-                        if count == 3:
-                            tick = 50000000
-                            break
-                    if tick == 50000000:
-                        rc[key_name].append(tick)
-                        break
-
-            # M
-            for ac in zone2.aclist:
-                ac.move()
-
-            tick += 1
-
-        # Record results and do visualization
-        rc[key_name].append(tick * Aircraft.speed)
-        vw.release()
-        cv2.destroyAllWindows()
-        del zone2
-    
-    simulation_id += 1
-
-# Output final results
-rc.summarize()
+        mode = f'{steps}_step'
+        video_name = f'demo_{steps}steps.mp4'
+        print(f'    Case {simulation_id}: {steps} step test running...')
+
+    profile = PhaseProfile() if args.profile else None
+    simulation = Simulation(spec, steps, profile=profile)
+
+    # Renderers observing the simulation
+    if not args.headless or simulation_id in args.render_cases:
+        simulation.add_observer(VideoObserver(simulation.zone, os.path.join(args.output_dir, str(simulation_id)),
+                                              mode, video_name, args.dump_frames))
+
+    if simulation_id == args.profile_case:
+        profiler = cProfile.Profile()
+        result = profiler.runcall(simulation.run)
+        os.makedirs(os.path.join(args.output_dir, 'profile'), exist_ok=True)
+        profiler.dump_stats(os.path.join(args.output_dir, 'profile', f'{simulation_id}_{key_name}.prof'))
+    else:
+        result = simulation.run()
+    if result.success:
+        print(f"\tCase {simulation_id} successful.")
+
+    # Per-test profile
+    if profile is not None:
+        profile.write(os.path.join(args.output_dir, 'profile', f'{simulation_id}_{key_name}'))
+
+    return simulation_id, key_name, result
+
+def gen_jobs(generator, args, completed=(), specs=None):
+    '''
+        Generate the cases one after another and split each of them into one
+        test per forecast length. Cases in {completed} are skipped, the scenario
+        of every other case is stored in {specs} by id.
+    '''
+    for simulation_id in range(args.cases):
+        if simulation_id in completed:
+            continue
+        print(f"Generating case {simulation_id}...")
+        spec = gen_case(simulation_id, args.seed, generator, args.aircrafts, args.density)
+        if specs is not None:
+            specs[simulation_id] = spec
+        for steps in args.forecast_lengths:
+            yield simulation_id, steps, spec, args
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.profile:
+        os.makedirs(os.path.join(args.output_dir, 'profile'), exist_ok=True)
+    configure(args)
+
+    # Completed cases, kept when resuming a sweep with the same settings
+    settings = {name: getattr(args, name) for name in
+                ['zone_width', 'zone_height', 'aircrafts', 'forecast_lengths', 'seed', 'density', 'planner']}
+    try:
+        checkpoint = Checkpoint(os.path.join(args.output_dir, 'checkpoint.jsonl'), settings, args.resume)
+    except ValueError as e:
+        raise SystemExit(f'Cannot resume: {e}')
+
+    # Results recorder, every sample is also appended to samples.csv as it comes in.
+    # The log is rebuilt from the completed cases, dropping the tests of an interrupted one.
+    log_path = os.path.join(args.output_dir, 'samples.csv')
+    if os.path.exists(log_path):
+        os.remove(log_path)
+    rc = Recorder(os.path.join(args.output_dir, 'results.txt'), log_path)
+    for steps in args.forecast_lengths:
+        rc.add_key('Full' if steps == -1 else f'{steps}_step')
+    for simulation_id, entry in sorted(checkpoint.completed.items()):
+        for key_name, (value, failed) in entry['results'].items():
+            rc.add(key_name, value, failed=failed, case=simulation_id)
+    if len(checkpoint.completed) > 0:
+        print(f"Resuming: {len(checkpoint.completed)} cases already completed")
+
+    empty_zone = Zone(num_aircrafts=0, random_gen=False, aclist=[], w=args.zone_width, h=args.zone_height)
+    generator = ScenarioGenerator(empty_zone)
+    # Larger zones compute the conflicts of the chosen routes on demand
+    if args.density > 0 and len(generator.routes) <= ConflictTable.max_routes:
+        cache_dir = None if args.no_cache else os.path.join(args.output_dir, 'cache')
+        generator.table = ConflictTable.load(empty_zone, cache_dir=cache_dir)
+    args.render_cases = set(args.render_cases)
+    specs = {}
+    jobs = gen_jobs(generator, args, checkpoint.completed, specs)
+    if args.workers == 1:
+        outcomes = map(run_job, jobs)
+    else:
+        # Jobs are independent: fan them out across a process pool. map() yields
+        # results in submission order, so samples are merged exactly as in a serial run.
+        executor = ProcessPoolExecutor(max_workers=args.workers or os.cpu_count())
+        outcomes = executor.map(run_job, jobs, chunksize=len(args.forecast_lengths))
+
+    expansions = 0
+    profiles = []
+    pending = {}
+    for simulation_id, key_name, result in outcomes:
+        rc.add(key_name, result.flight_time, failed=not result.success, case=simulation_id)
+        expansions += result.expansions
+        if result.profile is not None:
+            profiles.append(result.profile)
+
+        # Checkpoint the case once all its tests are done
+        pending.setdefault(simulation_id, {})[key_name] = (result.flight_time, not result.success)
+        if len(pending[simulation_id]) == len(args.forecast_lengths):
+            spec = specs.pop(simulation_id)
+            checkpoint.add(simulation_id, f'{args.seed}-{simulation_id}', spec._asdict(), pending.pop(simulation_id))
+            rc.summarize()
+
+    if args.workers != 1:
+        executor.shutdown()
+
+    stats = generator.stats()
+    print(f"Scenario generation: {stats['accepted']} accepted out of {stats['attempts']} attempts "
+          f"({stats['acceptance_rate']:.1%}) over {stats['routes']} routes")
+    print(f"Planner {args.planner}: {expansions} states expanded")
+    # Worker processes have caches of their own
+    cache = default_segment.cache_info()
+    print(f"Default path segments: {cache.hits} cache hits, {cache.misses} misses" +
+          (" in the main process" if args.workers != 1 else ""))
+
+    # Output final results
+    rc.summarize()
+    rc.close()
+    checkpoint.close()
+    if args.profile:
+        write_summary(os.path.join(args.output_dir, 'profile.txt'), profiles)
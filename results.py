@@ -1,19 +1,241 @@
-import numpy as np
+import csv
+import json
+import math
+import os
+
+class QuantileSketch:
+    '''
+        Mergeable quantile sketch of positive values with a relative accuracy
+        of {accuracy}: values are counted in logarithmically sized buckets, so
+        memory grows with the logarithm of the range of values instead of with
+        their number. Values that are not positive share one bucket.
+    '''
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value):
+        if value <= 0:
+            self.zeros += 1
+        else:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+
+    def merge(self, other):
+        assert self.accuracy == other.accuracy
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q):
+        '''
+            Value of quantile {q} in [0, 1], NaN if nothing was added.
+        '''
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Middle of the bucket, within {accuracy} of every value in it
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+class RunningStats:
+    '''
+        Count, mean, variance (Welford's algorithm), min, max and quantiles of
+        a stream of values in constant memory. Failures are counted apart and
+        do not enter the statistics. Statistics gathered separately, e.g. by
+        parallel workers, are combined with merge().
+    '''
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        # Sum of squared differences from the mean
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.failures = 0
+        self.sketch = QuantileSketch()
+
+    def add(self, value, failed=False):
+        if failed:
+            self.failures += 1
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.sketch.add(value)
+
+    def merge(self, other):
+        if other.count > 0:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta * delta * self.count * other.count / count
+            self.count = count
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self.sketch.merge(other.sketch)
+        self.failures += other.failures
+
+    def quantile(self, q):
+        # The sketch is only accurate up to a relative error, keep within the exact range
+        return min(max(self.sketch.quantile(q), self.min), self.max)
+
+    @property
+    def variance(self):
+        # Sample variance
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
 
 # Special structure for storing and displaying experimental results
 class Recorder:
-    def __init__(self, outputdir):
+    '''
+        Keeps RunningStats per key and appends every sample to a CSV log as soon
+        as it is recorded, so that long runs can be watched while they go. The
+        log can be replayed into a Recorder to pick up or combine earlier runs.
+    '''
+    log_columns = ['case', 'key', 'value', 'failed']
+    quantiles = [0.5, 0.9, 0.99]
+
+    def __init__(self, outputdir, log_path=None):
+        '''
+            outputdir: file the summary is written to
+            log_path: CSV file every sample is appended to, None disables the log
+        '''
         self.meter = {}
         self.dir = outputdir
+        self.log = None
+        if log_path is not None:
+            new = not os.path.exists(log_path) or os.path.getsize(log_path) == 0
+            self.log = open(log_path, 'a', newline='')
+            self.writer = csv.writer(self.log)
+            if new:
+                self.writer.writerow(Recorder.log_columns)
+                self.log.flush()
+
     def __getitem__(self, key):
         return self.meter[key]
+
     def add_key(self, key):
         if key not in self.meter.keys():
-            self.meter[key] = []
+            self.meter[key] = RunningStats()
+
+    def add(self, key, value, failed=False, case=''):
+        '''
+            Record {value} under {key}, or a failure of test {case} if {failed}.
+        '''
+        self.add_key(key)
+        self.meter[key].add(value, failed)
+        if self.log is not None:
+            self.writer.writerow([case, key, value, int(failed)])
+            self.log.flush()
+
+    def replay(self, log_path):
+        '''
+            Add the samples of a log written by another Recorder, without logging
+            them again. Returns the (case, key) pairs replayed.
+        '''
+        replayed = []
+        with open(log_path, newline='') as f:
+            for row in csv.DictReader(f):
+                self.add_key(row['key'])
+                self.meter[row['key']].add(float(row['value']), row['failed'] == '1')
+                replayed.append((row['case'], row['key']))
+        return replayed
+
+    def merge(self, other):
+        for key, stats in other.meter.items():
+            self.add_key(key)
+            self.meter[key].merge(stats)
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
     def summarize(self):
-        f = open(self.dir, 'w')
-        for key in self.meter.keys():
-            l = self.meter[key]
-            self.meter[key] = np.mean(np.array(l))
-            f.write(key + ', ' + str(self.meter[key]) + '\n')
-        f.close()
+        columns = ['mean', 'std', 'min'] + [f'p{round(q * 100)}' for q in Recorder.quantiles] + \
+                  ['max', 'count', 'failures']
+        with open(self.dir, 'w') as f:
+            f.write('key, ' + ', '.join(columns) + '\n')
+            for key, stats in self.meter.items():
+                if stats.count > 0:
+                    values = [stats.mean, stats.std, stats.min] + \
+                             [stats.quantile(q) for q in Recorder.quantiles] + [stats.max]
+                else:
+                    values = [math.nan] * (len(columns) - 2)
+                f.write(key + ', ' + ', '.join(f'{value:.6g}' for value in values) +
+                        f', {stats.count}, {stats.failures}\n')
+
+class Checkpoint:
+    '''
+        Append-only log of the cases completed by a sweep, one JSON line per case
+        with its scenario and the result of every test, written once all tests of
+        the case are done. The first line holds the settings of the sweep, which
+        a resumed sweep must match.
+    '''
+    def __init__(self, path, settings, resume=False):
+        '''
+            path: file of the log
+            settings: dict of the options the results depend on
+            resume: keep the cases completed by an earlier run with the same settings,
+                    otherwise start over
+        '''
+        self.path = path
+        # Case id -> {'case', 'seed', 'spec', 'results': {key: [value, failed]}}
+        self.completed = {}
+        if resume and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path) as f:
+                lines = f.readlines()
+            header = json.loads(lines[0])
+            if header['settings'] != settings:
+                raise ValueError(f'{path} was written with {header["settings"]}, '
+                                 f'which differs from {settings}')
+            for line in lines[1:]:
+                # A crash may leave the last line incomplete
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                self.completed[entry['case']] = entry
+            # Rewrite without any incomplete line
+            with open(path, 'w') as f:
+                f.writelines(lines[:len(self.completed) + 1])
+            self.log = open(path, 'a')
+        else:
+            self.log = open(path, 'w')
+            self.write({'settings': settings})
+
+    def write(self, entry):
+        self.log.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self.log.flush()
+        os.fsync(self.log.fileno())
+
+    def add(self, case, seed, spec, results):
+        '''
+            Record that case {case}, generated from {seed} as {spec}, is complete
+            with {results}: {key: (value, failed)}.
+        '''
+        entry = {'case': case, 'seed': seed, 'spec': spec, 'results': results}
+        self.completed[case] = entry
+        self.write(entry)
+
+    def close(self):
+        self.log.close()
@@ -0,0 +1,132 @@
+'''
+    Regression cases of the simulation engine, run with python -m pytest from
+    the repository root.
+'''
+import contextlib
+import io
+import random
+
+import numpy as np
+import pytest
+
+from agents.aircraft import Aircraft
+from agents.engine import Simulation
+from agents.scenario import ScenarioGenerator
+from agents.zone import Zone, ZoneSpec
+
+def run(spec, forecast_length=-1):
+    # The engine reports dead ends on stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Simulation(spec, forecast_length).run()
+
+def collisions(spec, forecast_length=-1):
+    '''
+        Run {spec} tick by tick and return the (tick, id, id) at which two flying
+        aircraft occupy the same point or swap points, and the result.
+    '''
+    simulation = Simulation(spec, forecast_length)
+    frames = []
+    def record(zone, tick):
+        fleet = zone.fleet
+        frames.append((fleet.point[:fleet.size].copy(), ~fleet.arrived[:fleet.size]))
+    simulation.on('tick', record)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = simulation.run()
+
+    found = []
+    for tick, (points, flying) in enumerate(frames):
+        same = (points[:, None] == points[None, :]).all(axis=-1)
+        if tick + 1 < len(frames):
+            after, still = frames[tick + 1]
+            swap = (after[:, None] == points[None, :]).all(axis=-1) & \
+                   (points[:, None] == after[None, :]).all(axis=-1) & still[:, None] & still[None, :]
+            same |= swap
+        same &= flying[:, None] & flying[None, :]
+        found += [(tick, int(i), int(j)) for i, j in zip(*np.nonzero(np.triu(same, 1)))]
+    return found, result
+
+@pytest.mark.parametrize('forecast_length', [-1] + list(range(1, 11)))
+def test_dead_end_with_more_than_three_aircraft(forecast_length):
+    # Copying the priority list of an aircraft that did not hear of the receiver
+    # used to drop the receiver from its own list
+    spec = ZoneSpec(6, (((0, 8), (2, 0)), ((0, 1), (1, 10)), ((6, 0), (0, 3)),
+                        ((0, 9), (8, 0)), ((5, 0), (0, 2)), ((0, 7), (2, 0))), 10, 10)
+    result = run(spec, forecast_length)
+    assert result.dead_ends > 0
+    assert result.success
+
+@pytest.mark.parametrize('forecast_length', [-1] + list(range(1, 11)))
+def test_replanned_path_checked_against_other_aircraft(forecast_length):
+    # Only 0 and 1 conflict at first, the new path of 1 used to run into 2,
+    # which was left out of the replanning component
+    spec = ZoneSpec(3, (((0, 5), (8, 0)), ((10, 5), (2, 0)), ((5, 0), (10, 8))), 10, 10)
+    found, result = collisions(spec, forecast_length)
+    assert result.success
+    assert found == []
+
+def test_many_aircraft_sweep():
+    # On a 10 x 10 zone some cases of 11 and 12 aircraft crowd the same
+    # destinations and end in dead ends
+    zone = Zone(num_aircrafts=0, random_gen=False, aclist=[], w=20, h=20)
+    generator = ScenarioGenerator(zone)
+    rng = random.Random(0)
+    for num_aircrafts in range(4, 13):
+        for _ in range(5):
+            spec = generator.generate(num_aircrafts, rng, density=0.3)
+            found, result = collisions(spec)
+            assert result.success, spec
+            assert found == [], spec
+
+def sweep_specs(cases=3, size=20, density=0.3):
+    # Generated cases of 4 to 8 aircraft, far apart at first on a 20 x 20 zone
+    zone = Zone(num_aircrafts=0, random_gen=False, aclist=[], w=size, h=size)
+    generator = ScenarioGenerator(zone)
+    rng = random.Random(1)
+    return [generator.generate(num_aircrafts, rng, density=density)
+            for num_aircrafts in range(4, 9) for _ in range(cases)]
+
+def final_state(simulation):
+    fleet = simulation.zone.fleet
+    state = [getattr(fleet, name)[:fleet.size].copy()
+             for name in ['position', 'point', 'orientation', 'arrived', 'cursor']]
+    history = [(ac.path_history.total, np.array(list(ac.path_history))) for ac in simulation.zone.aclist]
+    return state, history
+
+@pytest.mark.parametrize('history_length', [-1, 3])
+@pytest.mark.parametrize('forecast_length', [-1, 1, 4])
+def test_skipping_quiet_ticks_changes_nothing(monkeypatch, history_length, forecast_length):
+    monkeypatch.setattr(Aircraft, 'history_length', history_length)
+    for spec in sweep_specs():
+        outcomes = []
+        for skip_quiet in [True, False]:
+            simulation = Simulation(spec, forecast_length, skip_quiet=skip_quiet)
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = simulation.run()
+            outcomes.append((result, final_state(simulation)))
+        (skipped, (state, history)), (stepped, (state_ref, history_ref)) = outcomes
+        assert skipped == stepped, spec
+        for array, expected in zip(state, state_ref):
+            np.testing.assert_array_equal(array, expected)
+        for (total, positions), (total_ref, positions_ref) in zip(history, history_ref):
+            assert total == total_ref
+            np.testing.assert_array_equal(positions, positions_ref)
+
+@pytest.mark.parametrize('forecast_length', [-1] + list(range(1, 11)))
+def test_conflict_check_cache_matches_fresh_check(monkeypatch, forecast_length):
+    # Every check made with the cache is repeated with an empty cache, which is
+    # then restored so that the run goes on with the cached entries
+    will_collide = Aircraft.willCollide
+    compared = []
+    def checked_twice(ac):
+        cached = will_collide(ac)
+        entries = dict(ac.checked)
+        ac.checked.clear()
+        fresh = will_collide(ac)
+        ac.checked = entries
+        compared.append(cached == fresh)
+        return cached
+    monkeypatch.setattr(Aircraft, 'willCollide', checked_twice)
+    for spec in sweep_specs(cases=2, size=10, density=0.5):
+        run(spec, forecast_length)
+    assert len(compared) > 0
+    assert all(compared)
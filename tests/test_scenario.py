@@ -0,0 +1,37 @@
+'''
+    Regression cases of scenario generation and of the options it is run with.
+'''
+import random
+
+import pytest
+
+from agents.scenario import ConflictTable, ScenarioGenerator
+from agents.zone import Zone
+from config import parse_args
+
+@pytest.mark.parametrize('w, h', [(10, 10), (7, 12)])
+def test_conflicts_on_demand_match_table(w, h):
+    zone = Zone(num_aircrafts=0, random_gen=False, aclist=[], w=w, h=h)
+    table = ConflictTable.load(zone, cache_dir=None)
+    generator = ScenarioGenerator(zone)
+    for route in range(len(generator.routes)):
+        # Routes sharing a source are never chosen together
+        other = generator.sources != generator.sources[route]
+        assert (generator.conflicts(route)[other] == table.conflict[other, route]).all()
+
+    with_table = ScenarioGenerator(zone, table)
+    for seed in range(20):
+        assert generator.generate(3, random.Random(seed)) == with_table.generate(3, random.Random(seed))
+
+@pytest.mark.parametrize('num_aircrafts', [1, 3, 5, 12, 36])
+def test_default_density_generates(num_aircrafts):
+    args = parse_args(['--aircrafts', str(num_aircrafts)])
+    zone = Zone(num_aircrafts=0, random_gen=False, aclist=[], w=args.zone_width, h=args.zone_height)
+    generator = ScenarioGenerator(zone)
+    spec = generator.generate(num_aircrafts, random.Random(0), args.density)
+    assert spec.num_aircrafts == num_aircrafts
+
+@pytest.mark.parametrize('argv', [['--aircrafts', '37'], ['--density', '1.5']])
+def test_unworkable_options_rejected(argv):
+    with pytest.raises(SystemExit):
+        parse_args(argv)